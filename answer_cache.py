@@ -0,0 +1,174 @@
+"""Cache of /api/ask answers keyed on the normalized question.
+
+Fans ask the same few questions over and over, and every upstream answer
+is slow and paid for. Questions are normalized (Unicode NFKC, case,
+punctuation and whitespace), so "What music do you play?" and "what
+music do you play" share an entry. The key also covers the backend, the
+model and a hash of the system prompt, so changing any of them starts
+afresh.
+
+Entries live in an in-process LRU for ANSWER_CACHE_TTL seconds. With
+ANSWER_CACHE_PERSIST=1 they are also written to the answer_cache table
+(migration 10), which workers share and which survives restarts. Hits
+are counted per entry; the counts are written to the table in batches.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from db import get_connection
+
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 24 * 3600))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1000))
+ANSWER_CACHE_PERSIST = os.getenv('ANSWER_CACHE_PERSIST', '0') == '1'
+# Pending hit counts are written to the table once this many accumulate
+HIT_FLUSH_THRESHOLD = 100
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(question):
+    text = unicodedata.normalize('NFKC', question).casefold()
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def cache_key(question, backend, model, system_prompt):
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    material = json.dumps([normalize_question(question), backend, model, prompt_hash])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class _Entry:
+    __slots__ = ('answer', 'question', 'backend', 'created_at', 'hits')
+
+    def __init__(self, answer, question, backend, created_at, hits=0):
+        self.answer = answer
+        self.question = question
+        self.backend = backend
+        self.created_at = created_at
+        self.hits = hits
+
+
+class AnswerCache:
+    """TTL + LRU cache of answers, optionally backed by SQLite.
+
+    ``stats`` counts hits, misses, stores and evictions; top() lists the
+    most asked questions.
+    """
+
+    def __init__(self, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE,
+                 persist=ANSWER_CACHE_PERSIST, path=None, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self.path = path
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._pending_hits = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached answer for ``key``, or None."""
+        if self.max_entries <= 0:
+            return None
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created_at >= self.ttl:
+                del self._entries[key]
+                entry = None
+        if entry is None and self.persist:
+            entry = self._load(key, now)
+        with self._lock:
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            entry.hits += 1
+            self.stats['hits'] += 1
+            if self.persist:
+                self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+                flush = sum(self._pending_hits.values()) >= HIT_FLUSH_THRESHOLD
+            else:
+                flush = False
+            answer = entry.answer
+        if flush:
+            self.flush_hits()
+        return answer
+
+    def put(self, key, answer, question='', backend=''):
+        if self.max_entries <= 0:
+            return
+        entry = _Entry(answer, question, backend, self._clock())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            self.stats['stores'] += 1
+        if self.persist:
+            conn = get_connection(self.path)
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO answer_cache '
+                    '(key, backend, question, answer, created_at, hits) '
+                    'VALUES (?, ?, ?, ?, ?, 0)',
+                    (key, backend, question, answer, entry.created_at))
+
+    def top(self, limit=10):
+        """The most hit cached questions, as ``(question, backend, hits)``."""
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry.hits,
+                             reverse=True)
+        return [(entry.question, entry.backend, entry.hits) for entry in entries[:limit]]
+
+    def flush_hits(self):
+        """Write the hit counts gathered since the last flush to the table."""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending:
+            return
+        conn = get_connection(self.path)
+        with conn:
+            conn.executemany('UPDATE answer_cache SET hits = hits + ? WHERE key = ?',
+                             [(count, key) for key, count in pending.items()])
+
+    def purge_expired(self):
+        """Delete expired rows from the table; returns how many."""
+        conn = get_connection(self.path)
+        with conn:
+            cursor = conn.execute('DELETE FROM answer_cache WHERE created_at <= ?',
+                                  (self._clock() - self.ttl,))
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending_hits.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self, key, now):
+        row = get_connection(self.path).execute(
+            'SELECT answer, question, backend, created_at, hits FROM answer_cache '
+            'WHERE key = ? AND created_at > ?',
+            (key, now - self.ttl)).fetchone()
+        return _Entry(*row) if row else None
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+
+answer_cache = AnswerCache()
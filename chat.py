@@ -0,0 +1,239 @@
+"""Backend-independent entry points for /api/ask.
+
+AI_BACKEND selects which module answers: worker_logic (OpenAI),
+gemini_logic or huggingface_logic. ask() returns the ``{"text": ...}``
+body non-streaming callers get. ask_stream() yields the answer in pieces
+as the backend produces them, and records time to first token in
+``stream_metrics``. sse_events() and ndjson_lines() turn those pieces
+into a response body, e.g. in Flask::
+
+    Response(sse_events(ask_stream(question)), mimetype=SSE_MIMETYPE,
+             headers=STREAM_HEADERS)
+
+Both consult ``answer_cache`` first, then ``semantic_cache`` for
+paraphrases when it is enabled, so common questions are answered without
+an upstream call; a cached answer streams as a single piece.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import gemini_logic
+import huggingface_logic
+import worker_logic
+from answer_cache import answer_cache, cache_key
+from semantic_cache import semantic_cache
+
+AI_BACKEND = os.getenv('AI_BACKEND', 'openai')
+BACKENDS = {
+    'openai': worker_logic,
+    'gemini': gemini_logic,
+    'huggingface': huggingface_logic,
+}
+# Model each backend answers with; part of the answer cache key
+MODELS = {
+    'openai': lambda: worker_logic.OPENAI_MODEL,
+    'gemini': lambda: gemini_logic.GEMINI_MODEL,
+    'huggingface': lambda: os.getenv('HF_MODEL', huggingface_logic.DEFAULT_MODEL),
+}
+
+SSE_MIMETYPE = 'text/event-stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Keep caches and reverse proxies (nginx) from buffering the stream
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+STREAM_METRICS_WINDOW = int(os.getenv('STREAM_METRICS_WINDOW', 1000))
+
+logger = logging.getLogger(__name__)
+
+
+def _backend(name):
+    name = name or AI_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown AI backend: {name}')
+    return name, BACKENDS[name]
+
+
+class _Lookup:
+    """Cache keys of one question, and where its answer was found."""
+
+    def __init__(self, question, name, module, cache, semantic):
+        model = MODELS[name]() if name in MODELS else ''
+        prompt = getattr(module, 'SYSTEM_PROMPT', '')
+        self.question = question
+        self.name = name
+        self.key = cache_key(question, name, model, prompt)
+        # Everything but the question: answers only match within it
+        self.scope = cache_key('', name, model, prompt)
+        self.cache = cache
+        self.semantic = semantic
+
+    def cached(self):
+        answer = self.cache.get(self.key)
+        if answer is not None or self.semantic is None:
+            return answer
+        try:
+            found = self.semantic.lookup(self.question, self.scope)
+        except Exception:
+            logger.exception('Semantic cache lookup failed')
+            return None
+        if found is None:
+            return None
+        self.cache.put(self.key, found[0], question=self.question, backend=self.name)
+        return found[0]
+
+    def store(self, answer):
+        # No text (e.g. a content-filter stop) is not an answer worth
+        # repeating for a day
+        if not answer or not answer.strip():
+            return
+        self.cache.put(self.key, answer, question=self.question, backend=self.name)
+        if self.semantic is not None:
+            try:
+                self.semantic.add(self.question, answer, self.scope)
+            except Exception:
+                logger.exception('Semantic cache store failed')
+
+
+def ask(question, backend=None, cache=answer_cache, semantic=semantic_cache):
+    """Answer ``question`` in one piece; returns ``{"text": ...}``."""
+    name, module = _backend(backend)
+    lookup = _Lookup(question, name, module, cache, semantic)
+    cached = lookup.cached()
+    if cached is not None:
+        return {'text': cached}
+    result = module.ask(question)
+    if 'text' in result:
+        text = result['text']
+    else:
+        # worker_logic returns the OpenAI completion as is. Refusals and
+        # tool calls come with content null; pass a refusal on, uncached.
+        message = result['choices'][0]['message']
+        text = message.get('content')
+        if text is None:
+            return {'text': message.get('refusal') or ''}
+    lookup.store(text)
+    return {'text': text}
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[max(int(len(values) * pct + 0.5) - 1, 0)]
+
+
+class StreamMetrics:
+    """Time to first token and total time of recent streams, per backend.
+
+    Keeps the last ``window`` streams of each backend; summary() reports
+    their median and p95 in milliseconds.
+    """
+
+    def __init__(self, window=STREAM_METRICS_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, backend, first_token, total):
+        with self._lock:
+            samples = self._samples.setdefault(backend, deque(maxlen=self.window))
+            samples.append((first_token, total))
+
+    def record_error(self, backend):
+        with self._lock:
+            self._errors[backend] = self._errors.get(backend, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            errors = dict(self._errors)
+        summary = {}
+        for name in samples.keys() | errors.keys():
+            values = samples.get(name, [])
+            first_tokens = [first * 1000 for first, _ in values if first is not None]
+            totals = [total * 1000 for _, total in values]
+            stats = {'streams': len(values), 'errors': errors.get(name, 0)}
+            if first_tokens:
+                stats['ttft_p50_ms'] = _percentile(first_tokens, 0.5)
+                stats['ttft_p95_ms'] = _percentile(first_tokens, 0.95)
+            if totals:
+                stats['total_p50_ms'] = _percentile(totals, 0.5)
+            summary[name] = stats
+        return summary
+
+
+stream_metrics = StreamMetrics()
+
+
+def ask_stream(question, backend=None, metrics=stream_metrics, cache=answer_cache,
+               semantic=semantic_cache):
+    """Yield the answer to ``question`` in pieces as they are generated."""
+    name, module = _backend(backend)
+    lookup = _Lookup(question, name, module, cache, semantic)
+    cached = lookup.cached()
+    if cached is not None:
+        yield cached
+        return
+    started = time.perf_counter()
+    first_token = None
+    pieces = []
+    try:
+        for chunk in module.ask_stream(question):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            pieces.append(chunk)
+            yield chunk
+    except Exception:
+        metrics.record_error(name)
+        raise
+    metrics.record(name, first_token, time.perf_counter() - started)
+    lookup.store(''.join(pieces))
+
+
+def stream_format(accept='', requested=None):
+    """Pick 'sse', 'ndjson' or None (plain JSON) for a request.
+
+    ``requested`` is an explicit ?stream= value; otherwise the Accept
+    header decides, so existing callers keep getting JSON.
+    """
+    if requested:
+        requested = requested.lower()
+        if requested == 'ndjson':
+            return 'ndjson'
+        return 'sse' if requested in ('1', 'true', 'sse') else None
+    if SSE_MIMETYPE in (accept or ''):
+        return 'sse'
+    if NDJSON_MIMETYPE in (accept or ''):
+        return 'ndjson'
+    return None
+
+
+def _stream_body(chunks, encode):
+    pieces = []
+    try:
+        for chunk in chunks:
+            pieces.append(chunk)
+            yield encode(None, {'text': chunk})
+    except Exception:
+        logger.exception('Streaming AI response failed')
+        yield encode('error', {'error': 'AI request failed'})
+        return
+    yield encode('done', {'text': ''.join(pieces), 'done': True})
+
+
+def _sse(event, data):
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'
+
+
+def sse_events(chunks):
+    """Server-Sent Events: one ``data: {"text": piece}`` event per piece,
+    then a ``done`` event with the whole answer, or an ``error`` event."""
+    return _stream_body(chunks, _sse)
+
+
+def ndjson_lines(chunks):
+    """Newline-delimited JSON with the same objects as sse_events()."""
+    return _stream_body(chunks, lambda event, data: json.dumps(data) + '\n')
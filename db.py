@@ -0,0 +1,132 @@
+"""Shared SQLite access for the API and the maintenance scripts.
+
+Connections are opened in WAL mode with tuned pragmas so that concurrent
+gunicorn workers can read while one of them writes, and each thread keeps
+reusing its own connection instead of reconnecting per request.
+"""
+import os
+import sqlite3
+import threading
+import weakref
+
+DB_PATH = os.getenv(
+    'DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'app.db'))
+
+# How long a writer waits for the lock before raising "database is locked".
+BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+# Page cache per connection, in KiB.
+CACHE_SIZE_KIB = int(os.getenv('DB_CACHE_SIZE_KIB', 16 * 1024))
+# Bytes of the database file mapped into memory for reads.
+MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 128 * 1024 * 1024))
+
+PRAGMAS = (
+    # WAL is persistent in the file; readers no longer block the writer
+    ('journal_mode', 'WAL'),
+    # Safe with WAL: only the last transactions can be lost on power failure
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', BUSY_TIMEOUT_MS),
+    # A negative cache_size is a size in KiB rather than pages
+    ('cache_size', -CACHE_SIZE_KIB),
+    ('mmap_size', MMAP_SIZE),
+    ('temp_store', 'MEMORY'),
+)
+
+
+def connect(path=None, check_same_thread=True):
+    """Open a connection to the app database with the tuned pragmas."""
+    path = path or DB_PATH
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class _Holder:
+    """Thread-local owner of a thread's connection.
+
+    The thread's local storage is the only strong reference to it, so it
+    is collected when the thread exits, and its finalizer closes the
+    connection.
+    """
+
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionPool:
+    """Hands out one reused connection per thread.
+
+    A connection is closed when its thread exits, so thread-per-request
+    servers do not accumulate them. Connections opened before a fork
+    (e.g. gunicorn --preload) are never shared with the child; the pool
+    starts afresh in the new process.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DB_PATH
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._connections = set()
+
+    def connection(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            # Each connection stays on its thread; check_same_thread is only
+            # relaxed so it can be closed from whichever thread shuts down
+            # or collects the holder.
+            conn = connect(self.path, check_same_thread=False)
+            holder = self._local.holder = _Holder(conn)
+            with self._lock:
+                self._connections.add(conn)
+            weakref.finalize(holder, self._discard, conn)
+        return holder.conn
+
+    def __len__(self):
+        return len(self._connections)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, set()
+            self._local = threading.local()
+        for conn in connections:
+            conn.close()
+
+    def _discard(self, conn):
+        # Runs when a holder is collected, which may happen while _lock is
+        # held (close() drops the thread-locals); set.discard needs no lock.
+        self._connections.discard(conn)
+        conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=None):
+    """Return the process-wide pool for ``path`` (defaults to DB_PATH)."""
+    path = path or DB_PATH
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def get_connection(path=None):
+    """Return this thread's pooled connection to the app database."""
+    return get_pool(path).connection()
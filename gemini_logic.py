@@ -0,0 +1,67 @@
+"""Answer chat questions with Google's Gemini API.
+
+``genai.configure`` replaces the library's global client settings, and a
+GenerativeModel opens its gRPC channel on first use. Configuring and
+building a model on every question therefore paid for a new client and
+TLS handshake each time. Models are instead built once per
+(api_key, model) pair, bound to their own client while holding a lock,
+and reused, so each question costs only the generate call.
+"""
+import os
+import threading
+
+try:
+    import google.generativeai as genai
+except ImportError:  # optional dependency; only needed for this backend
+    genai = None
+
+SYSTEM_PROMPT = 'You are an AI DJ assistant for TheBadGuyHimself.'
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-pro')
+
+
+class ModelCache:
+    """Configured GenerativeModel per (api_key, model name)."""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key, model_name=GEMINI_MODEL):
+        key = (api_key, model_name)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        if genai is None:
+            raise RuntimeError('google-generativeai is not installed')
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                # configure() is global: build the model and bind it to the
+                # client for this key before another thread reconfigures.
+                genai.configure(api_key=api_key)
+                model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_PROMPT)
+                model._client = genai.client.get_default_generative_client()
+                self._models[key] = model
+            return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+models = ModelCache()
+
+
+def ask(question, api_key=None):
+    """Send ``question`` to Gemini; returns ``{"text": ...}``."""
+    api_key = api_key or os.getenv('GEMINI_API_KEY')
+    response = models.get(api_key).generate_content(question)
+    return {'text': response.text}
+
+
+def ask_stream(question, api_key=None):
+    """Yield the answer to ``question`` in pieces as Gemini generates it."""
+    api_key = api_key or os.getenv('GEMINI_API_KEY')
+    for chunk in models.get(api_key).generate_content(question, stream=True):
+        if chunk.text:
+            yield chunk.text
@@ -0,0 +1,310 @@
+"""Answer chat questions with a local HuggingFace text-generation model.
+
+Loading a pipeline reads the tokenizer and weights from disk, which takes
+seconds and hundreds of MB, so each model is loaded once per process and
+kept in ``registry``. When several HF_MODEL values are in use, the least
+recently used pipelines are dropped once their weights exceed
+HF_CACHE_BYTES.
+
+Concurrent prompts for the same model are micro-batched: a scheduler
+thread collects them for up to HF_BATCH_WAIT_MS, or until HF_BATCH_SIZE
+are waiting, and runs them as one padded batch. HF_BATCH_SIZE=1 turns
+batching off.
+
+ask_stream() yields the generated text as the model produces it. It runs
+outside the batcher, one generation at a time per model.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from transformers import TextIteratorStreamer, pipeline
+except ImportError:  # optional dependency; only needed for this backend
+    TextIteratorStreamer = pipeline = None
+
+DEFAULT_MODEL = 'distilgpt2'
+MAX_NEW_TOKENS = int(os.getenv('HF_MAX_NEW_TOKENS', 20))
+HF_CACHE_BYTES = int(os.getenv('HF_CACHE_BYTES', 2 * 1024 ** 3))
+HF_BATCH_SIZE = int(os.getenv('HF_BATCH_SIZE', 8))
+HF_BATCH_WAIT_MS = float(os.getenv('HF_BATCH_WAIT_MS', 5))
+
+logger = logging.getLogger(__name__)
+
+
+def _load(model):
+    if pipeline is None:
+        raise RuntimeError('transformers is not installed')
+    pipe = pipeline('text-generation', model=model)
+    # Batches are padded; decoder-only models need a pad token and padding
+    # on the left so generation continues right after each prompt.
+    tokenizer = getattr(pipe, 'tokenizer', None)
+    if tokenizer is not None:
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token_id = pipe.model.config.eos_token_id
+        tokenizer.padding_side = 'left'
+    return pipe
+
+
+def _model_bytes(pipe):
+    """Size of the pipeline's weights, or 0 if it does not expose them."""
+    model = getattr(pipe, 'model', None)
+    if model is None or not hasattr(model, 'parameters'):
+        return 0
+    return sum(param.numel() * param.element_size() for param in model.parameters())
+
+
+class _Pending:
+    __slots__ = ('prompt', 'kwargs', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, prompt, kwargs):
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Queued by MicroBatcher.stop() to end the scheduler thread
+_STOP = object()
+
+
+class MicroBatcher:
+    """Runs prompts from concurrent callers through ``pipe`` in batches.
+
+    A daemon thread takes the oldest waiting prompt, waits up to
+    ``max_wait`` seconds from its arrival for up to ``max_batch`` prompts
+    with the same generation arguments, and runs them in one call. Each
+    caller gets its own output, or the batch's exception. The thread is
+    started on first use, and again after a fork. stop() ends it once the
+    prompts already queued are answered, releasing its hold on ``pipe``.
+    """
+
+    def __init__(self, pipe, max_batch=HF_BATCH_SIZE, max_wait=HF_BATCH_WAIT_MS / 1000,
+                 lock=None):
+        self.pipe = pipe
+        self.lock = lock or threading.Lock()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.prompts = 0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+
+    def submit(self, prompt, **kwargs):
+        pending = _Pending(prompt, kwargs)
+        with self._cond:
+            stopped = self._stopped
+            if not stopped:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._queue = []
+                    self._thread = threading.Thread(target=self._run, daemon=True,
+                                                    name='hf-batcher')
+                    self._thread.start()
+                self._queue.append(pending)
+                self._cond.notify()
+        if stopped:
+            # A caller that looked the pipeline up just before it was evicted
+            with self.lock:
+                return self.pipe(prompt, **kwargs)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            first = self._queue[0]
+            if first is _STOP:
+                self._queue.pop(0)
+                return None
+            deadline = first.enqueued_at + self.max_wait
+            while len(self._queue) < self.max_batch and _STOP not in self._queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [pending for pending in self._queue
+                     if pending is not _STOP and pending.kwargs == first.kwargs]
+            batch = batch[:self.max_batch]
+            self._queue = [pending for pending in self._queue if pending not in batch]
+            return batch
+
+    def stop(self):
+        """End the scheduler thread after the prompts already queued."""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            if self._pid == os.getpid():
+                self._queue.append(_STOP)
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                with self.lock:
+                    if len(batch) == 1:
+                        outputs = [self.pipe(batch[0].prompt, **batch[0].kwargs)]
+                    else:
+                        outputs = self.pipe([pending.prompt for pending in batch],
+                                            batch_size=len(batch), **batch[0].kwargs)
+                for pending, output in zip(batch, outputs):
+                    pending.result = output
+            except Exception as exc:
+                for pending in batch:
+                    pending.error = exc
+            finally:
+                self.batches += 1
+                self.prompts += len(batch)
+                for pending in batch:
+                    pending.done.set()
+
+
+class _Entry:
+    __slots__ = ('pipe', 'size', 'lock', 'batcher')
+
+    def __init__(self, pipe, size, max_batch):
+        self.pipe = pipe
+        self.size = size
+        # Tokenizers and pipelines are not safe to call from two threads
+        self.lock = threading.Lock()
+        self.batcher = MicroBatcher(pipe, max_batch, lock=self.lock) if max_batch > 1 else None
+
+    def close(self):
+        # The batcher thread would otherwise keep the weights alive
+        if self.batcher is not None:
+            self.batcher.stop()
+
+
+class PipelineRegistry:
+    """Loads each model's pipeline once and keeps it, LRU-bounded by the
+    total size of the weights.
+
+    Concurrent first requests for a model wait for a single load; other
+    models stay usable meanwhile. The most recently used pipeline is kept
+    even if it alone exceeds ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes=HF_CACHE_BYTES, loader=None, sizer=_model_bytes,
+                 max_batch=HF_BATCH_SIZE):
+        self.max_bytes = max_bytes
+        self.max_batch = max_batch
+        self.loader = loader
+        self.sizer = sizer
+        self.loads = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        """Return the entry for ``model``, loading it on first use."""
+        with self._lock:
+            entry = self._entries.get(model)
+            if entry is not None:
+                self._entries.move_to_end(model)
+                return entry
+            load_lock = self._loading.setdefault(model, threading.Lock())
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(model)
+                if entry is not None:
+                    return entry
+            try:
+                pipe = (self.loader or _load)(model)
+                entry = _Entry(pipe, self.sizer(pipe), self.max_batch)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(model, None)
+                raise
+            with self._lock:
+                self._loading.pop(model, None)
+                self.loads += 1
+                self._entries[model] = entry
+                self._evict()
+            return entry
+
+    def generate(self, model, prompt, **kwargs):
+        entry = self.get(model)
+        if entry.batcher is not None:
+            return entry.batcher.submit(prompt, **kwargs)
+        with entry.lock:
+            return entry.pipe(prompt, **kwargs)
+
+    def warm(self, models=None):
+        """Load ``models`` (default: HF_MODEL) ahead of the first request."""
+        for model in models or [os.getenv('HF_MODEL', DEFAULT_MODEL)]:
+            self.get(model)
+            logger.info('Loaded HuggingFace model %s', model)
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.close()
+            self._entries.clear()
+
+    def __contains__(self, model):
+        return model in self._entries
+
+    def _evict(self):
+        total = sum(entry.size for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            model, entry = self._entries.popitem(last=False)
+            total -= entry.size
+            entry.close()
+            self.evictions += 1
+            logger.info('Evicted HuggingFace model %s', model)
+
+
+registry = PipelineRegistry()
+
+
+def ask(prompt, model=None):
+    """Generate a reply to ``prompt``; returns ``{"text": ...}``."""
+    model = model or os.getenv('HF_MODEL', DEFAULT_MODEL)
+    result = registry.generate(model, prompt, max_new_tokens=MAX_NEW_TOKENS)
+    return {'text': result[0]['generated_text']}
+
+
+def ask_stream(prompt, model=None):
+    """Yield the text generated after ``prompt`` as the model produces it."""
+    if TextIteratorStreamer is None:
+        raise RuntimeError('transformers is not installed')
+    entry = registry.get(model or os.getenv('HF_MODEL', DEFAULT_MODEL))
+    pipe = entry.pipe
+    streamer = TextIteratorStreamer(pipe.tokenizer, skip_prompt=True,
+                                    skip_special_tokens=True)
+    errors = []
+
+    def generate():
+        try:
+            with entry.lock:
+                inputs = pipe.tokenizer(prompt, return_tensors='pt')
+                pipe.model.generate(**inputs, streamer=streamer,
+                                    max_new_tokens=MAX_NEW_TOKENS,
+                                    pad_token_id=pipe.tokenizer.pad_token_id)
+        except Exception as exc:
+            # generate() only ends the streamer when it succeeds; end it
+            # here so the consumer stops waiting, then re-raise there.
+            errors.append(exc)
+            streamer.end()
+
+    thread = threading.Thread(target=generate, daemon=True, name='hf-stream')
+    thread.start()
+    yield from streamer
+    thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,307 @@
+"""Versioned schema migrations for the app database.
+
+The schema version lives in ``PRAGMA user_version``. Each step runs in its
+own ``BEGIN IMMEDIATE`` transaction together with the version bump, so a
+failed step leaves the database at the previous version. In WAL mode
+readers keep working while a step runs; concurrent writers wait on the
+busy timeout.
+
+Add new steps to the end of MIGRATIONS; never edit one that has shipped.
+"""
+from tokens import TOKEN_TTL
+
+
+def _add_token_expiry(conn):
+    conn.execute('ALTER TABLE tokens ADD COLUMN expires_at INTEGER')
+    conn.execute(
+        "UPDATE tokens SET expires_at = CAST(strftime('%s', created_at) AS INTEGER) + ?",
+        (int(TOKEN_TTL),))
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tokens_expires_at ON tokens (expires_at)')
+
+
+MIGRATIONS = [
+    # 1: the original schema from init_db.py. IF NOT EXISTS lets it adopt
+    # databases created before migrations were versioned.
+    ('initial schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS tracks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            is_premium BOOLEAN DEFAULT FALSE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tokens (
+            token TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS forums (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            premium_only BOOLEAN DEFAULT TRUE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            forum_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(forum_id) REFERENCES forums(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''',
+    ]),
+    # 2: secondary indexes for a forum's messages in time order and for all
+    # tokens belonging to one user.
+    ('secondary indexes', [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_forum_timestamp
+        ON messages (forum_id, timestamp)
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_tokens_user_id ON tokens (user_id)',
+        'ANALYZE',
+    ]),
+    # 3: per-table change counters, bumped by triggers, so list endpoints can
+    # derive an ETag without reading the table.
+    ('table change counters', [
+        '''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO table_versions (name, version) VALUES ('tracks', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS tracks_version_insert AFTER INSERT ON tracks
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tracks';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tracks_version_update AFTER UPDATE ON tracks
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tracks';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tracks_version_delete AFTER DELETE ON tracks
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tracks';
+        END
+        ''',
+    ]),
+    # 4: full-text index over track titles. External-content FTS5 table kept
+    # in sync by triggers; unicode61 with remove_diacritics folds "Tiësto"
+    # to "tiesto", and the prefix indexes make short prefix queries cheap.
+    ('track title search', [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+            title,
+            content='tracks',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks
+        BEGIN
+            INSERT INTO tracks_fts (rowid, title) VALUES (new.id, new.title);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks
+        BEGIN
+            INSERT INTO tracks_fts (tracks_fts, rowid, title)
+            VALUES ('delete', old.id, old.title);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tracks_fts_update AFTER UPDATE OF title ON tracks
+        BEGIN
+            INSERT INTO tracks_fts (tracks_fts, rowid, title)
+            VALUES ('delete', old.id, old.title);
+            INSERT INTO tracks_fts (rowid, title) VALUES (new.id, new.title);
+        END
+        ''',
+        # Index the tracks that existed before this migration
+        "INSERT INTO tracks_fts (tracks_fts) VALUES ('rebuild')",
+    ]),
+    # 5: change counter for token resolution. Revoking a token or changing
+    # a user's premium flag bumps it, telling every worker's token cache to
+    # drop its entries. New tokens do not need to invalidate anything.
+    ('token change counter', [
+        "INSERT OR IGNORE INTO table_versions (name, version) VALUES ('tokens', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS tokens_version_delete AFTER DELETE ON tokens
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tokens';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS tokens_version_update AFTER UPDATE ON tokens
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tokens';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_premium_version
+        AFTER UPDATE OF is_premium ON users
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tokens';
+        END
+        ''',
+    ]),
+    # 6: token expiry. expires_at is a unix timestamp moved forward on use
+    # (sliding sessions); existing tokens get TOKEN_TTL from creation.
+    ('token expiry', _add_token_expiry),
+    # 7: second tier of the YouTube response cache, so entries survive
+    # restarts and are shared by every worker. fetched_at is a unix time.
+    ('youtube cache', [
+        '''
+        CREATE TABLE IF NOT EXISTS youtube_cache (
+            channel_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    # 8: one row per channel being fetched from YouTube, so only one worker
+    # process calls the API for it at a time. A failed fetch leaves its
+    # error behind for the workers that were waiting on it.
+    ('youtube fetch locks', [
+        '''
+        CREATE TABLE IF NOT EXISTS youtube_fetch_locks (
+            channel_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            error TEXT
+        )
+        ''',
+    ]),
+    # 9: YouTube quota units spent per quota day (midnight to midnight
+    # Pacific), and a decaying request score per channel for scheduling
+    # refreshes.
+    ('youtube quota and popularity', [
+        '''
+        CREATE TABLE IF NOT EXISTS youtube_quota_usage (
+            day TEXT PRIMARY KEY,
+            units INTEGER NOT NULL DEFAULT 0,
+            calls INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS youtube_channels (
+            channel_id TEXT PRIMARY KEY,
+            score REAL NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    # 10: optional persistent tier of the /api/ask answer cache. key is a
+    # hash of the normalized question, backend, model and system prompt.
+    ('answer cache', [
+        '''
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            key TEXT PRIMARY KEY,
+            backend TEXT NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_answer_cache_created_at ON answer_cache (created_at)',
+    ]),
+    # 11: narrow the token change counter triggers from migration 5. Sliding
+    # an expiry forward and sweeping rows that had already expired change
+    # nothing a token cache holds, but bumped the counter and emptied every
+    # worker's cache.
+    ('token change counter without expiry writes', [
+        'DROP TRIGGER IF EXISTS tokens_version_update',
+        '''
+        CREATE TRIGGER tokens_version_update AFTER UPDATE OF user_id ON tokens
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tokens';
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS tokens_version_delete',
+        '''
+        CREATE TRIGGER tokens_version_delete AFTER DELETE ON tokens
+        WHEN old.expires_at > CAST(strftime('%s', 'now') AS INTEGER)
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'tokens';
+        END
+        ''',
+    ]),
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+class MigrationError(Exception):
+    pass
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to ``target`` (default: the latest).
+
+    Returns the schema version the database ends up at. Steps are
+    callables taking the connection, or lists of SQL statements.
+    """
+    target = LATEST_VERSION if target is None else target
+    if not 0 <= target <= LATEST_VERSION:
+        raise MigrationError(f"Unknown schema version {target}")
+    if current_version(conn) > LATEST_VERSION:
+        raise MigrationError(
+            f"Database is at version {current_version(conn)}, newer than "
+            f"this code ({LATEST_VERSION})")
+
+    isolation_level = conn.isolation_level
+    # Manage transactions explicitly; the sqlite3 module would otherwise
+    # commit implicitly around DDL statements.
+    conn.isolation_level = None
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            # Re-read under the write lock: another worker may have applied
+            # the step while we waited for it.
+            version = current_version(conn)
+            if version >= target:
+                conn.execute('COMMIT')
+                return version
+            description, step = MIGRATIONS[version]
+            try:
+                if callable(step):
+                    step(conn)
+                else:
+                    for statement in step:
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.execute('COMMIT')
+            except Exception as exc:
+                conn.execute('ROLLBACK')
+                raise MigrationError(
+                    f"Migration {version + 1} ({description}) failed: {exc}"
+                ) from exc
+    finally:
+        conn.isolation_level = isolation_level
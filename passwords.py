@@ -0,0 +1,121 @@
+"""Password hashing off the request thread.
+
+Hashes come from werkzeug's generate_password_hash and are checked with
+check_password_hash, as Flask apps do, so existing users.password_hash
+values keep verifying. The work runs in a bounded process pool: a burst
+of signups queues for PASSWORD_HASH_WORKERS processes instead of taking
+every core from the workers serving other requests.
+
+When PASSWORD_HASH_METHOD changes, a successful login transparently
+stores a new hash with the current parameters.
+"""
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+SALT_LENGTH = 16
+
+
+def _check_password(stored, password):
+    # werkzeug raises ValueError for a hash method it does not know
+    try:
+        return check_password_hash(stored, password)
+    except ValueError:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _stored_method(method):
+    """``method`` as werkzeug writes it into hashes.
+
+    werkzeug fills in defaults ('scrypt' -> 'scrypt:32768:8:1',
+    'pbkdf2:sha256' -> 'pbkdf2:sha256:<iterations>'); hashing once shows
+    the expanded form.
+    """
+    return generate_password_hash('', method, 1).split('$', 1)[0]
+
+
+def needs_rehash(stored, method=None):
+    """True when ``stored`` was made with different hash parameters."""
+    return stored.split('$', 1)[0] != _stored_method(method or PASSWORD_HASH_METHOD)
+
+
+class HashPool:
+    """Runs hashing and verification in a bounded process pool.
+
+    The executor is created lazily and again after a fork, so it can be
+    set up at import time under gunicorn --preload. ``workers=0`` hashes
+    inline on the calling thread.
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, method=None):
+        self.workers = workers
+        self.method = method or PASSWORD_HASH_METHOD
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            executor = self._executor
+        return executor.submit(fn, *args).result()
+
+    def hash_password(self, password):
+        return self._submit(generate_password_hash, password, self.method, SALT_LENGTH)
+
+    def check_password(self, stored, password):
+        return self._submit(_check_password, stored, password)
+
+    def verify_and_update(self, stored, password):
+        """Return ``(valid, new_hash)``; new_hash is set when the password is
+        right but was hashed with outdated parameters."""
+        if not self.check_password(stored, password):
+            return False, None
+        if needs_rehash(stored, self.method):
+            return True, self.hash_password(password)
+        return True, None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+
+hash_pool = HashPool()
+
+
+def hash_password(password):
+    return hash_pool.hash_password(password)
+
+
+def authenticate(conn, username, password, pool=hash_pool):
+    """Return the user id for valid credentials, else None.
+
+    Rehashes and stores the password when the hash parameters changed.
+    """
+    row = conn.execute('SELECT id, password_hash FROM users WHERE username = ?',
+                       (username,)).fetchone()
+    if row is None:
+        # Spend the same time as a real check so usernames can't be probed
+        pool.hash_password(password)
+        return None
+    user_id, stored = row
+    valid, new_hash = pool.verify_and_update(stored, password)
+    if not valid:
+        return None
+    if new_hash:
+        with conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?',
+                         (new_hash, user_id))
+    return user_id
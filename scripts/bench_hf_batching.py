@@ -0,0 +1,72 @@
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from huggingface_logic import (DEFAULT_MODEL, HF_BATCH_SIZE, HF_BATCH_WAIT_MS,
+                               MicroBatcher, PipelineRegistry)
+
+PROMPTS = ['What music do you play?', 'When is the next live set?',
+           'How do I book you for a party?', 'Which hardstyle tracks are in the mix?',
+           'Where can I listen to the latest mix?', 'Do you play techno?']
+
+
+def run(generate, clients, requests_per_client, max_new_tokens):
+    """Each client asks in a loop; returns per-request latencies in ms and
+    the wall time."""
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index):
+        for i in range(requests_per_client):
+            prompt = PROMPTS[(index + i) % len(PROMPTS)]
+            started = time.perf_counter()
+            generate(prompt, max_new_tokens=max_new_tokens)
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput of the HuggingFace backend with and without "
+                    "micro-batching (needs transformers and torch)")
+    parser.add_argument('--model', default=os.getenv('HF_MODEL', DEFAULT_MODEL))
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=HF_BATCH_SIZE)
+    parser.add_argument('--wait-ms', type=float, default=HF_BATCH_WAIT_MS)
+    parser.add_argument('--max-new-tokens', type=int, default=20)
+    args = parser.parse_args()
+
+    registry = PipelineRegistry(max_batch=1)
+    started = time.perf_counter()
+    entry = registry.get(args.model)
+    print(f"Loaded {args.model} in {time.perf_counter() - started:.1f}s")
+    batcher = MicroBatcher(entry.pipe, args.batch_size, args.wait_ms / 1000)
+    # Compile kernels and fill caches before timing
+    registry.generate(args.model, PROMPTS[0], max_new_tokens=args.max_new_tokens)
+
+    print(f"{'mode':<10} {'prompts/s':>10} {'p50 ms':>8} {'max ms':>8}")
+    modes = [('single', lambda prompt, **kwargs: registry.generate(args.model, prompt, **kwargs)),
+             ('batched', batcher.submit)]
+    for label, generate in modes:
+        latencies, elapsed = run(generate, args.clients, args.requests, args.max_new_tokens)
+        print(f"{label:<10} {len(latencies) / elapsed:>10.2f} "
+              f"{statistics.median(latencies):>8.0f} {max(latencies):>8.0f}")
+    print(f"batched: {batcher.prompts} prompts in {batcher.batches} batches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_track_search import populate
+from db import connect
+from migrations import migrate
+from passwords import PASSWORD_HASH_METHOD, HashPool
+from tracks import list_tracks
+
+
+def percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[max(int(len(timings) * pct) - 1, 0)]
+
+
+def run(path, pool, signups, concurrency, duration):
+    """Time list_tracks (the /api/tracks query) while a signup storm hashes
+    passwords through ``pool``; returns latencies in ms."""
+    stop = threading.Event()
+    remaining = iter(range(signups))
+    lock = threading.Lock()
+
+    def signup():
+        while not stop.is_set():
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            pool.hash_password('correct horse battery staple')
+
+    storm = [threading.Thread(target=signup) for _ in range(concurrency)]
+    for thread in storm:
+        thread.start()
+
+    conn = connect(path)
+    timings = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        list_tracks(conn, 0, 50)
+        timings.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.005)
+    stop.set()
+    for thread in storm:
+        thread.join()
+    conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="p99 of the track list query during a signup storm, "
+                    "hashing inline vs in the process pool")
+    parser.add_argument('--tracks', type=int, default=10_000)
+    parser.add_argument('--signups', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--method', default=PASSWORD_HASH_METHOD)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        conn = connect(path)
+        migrate(conn)
+        populate(conn, args.tracks)
+        conn.close()
+
+        print(f"{'mode':<16} {'requests':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for label, pool in [('idle', None),
+                            ('inline', HashPool(workers=0, method=args.method)),
+                            ('pool', HashPool(workers=args.workers, method=args.method))]:
+            if pool is None:
+                timings = run(path, HashPool(workers=0), 0, 0, args.duration)
+            else:
+                timings = run(path, pool, args.signups, args.concurrency,
+                              args.duration)
+                pool.shutdown()
+            print(f"{label:<16} {len(timings):>8} {percentile(timings, 0.5):>8.2f} "
+                  f"{percentile(timings, 0.99):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import connect
+from migrations import migrate
+from tracks import search_tracks
+
+ARTISTS = ['Tiësto', 'KREAM', 'Matroda', 'Hardwell', 'Blasterjaxx', 'ZHU',
+           'Bedouin', 'Vintage Culture', 'Dimitri Vegas', 'Maddix', 'Ciszak',
+           'Eurythmics', 'Timmy Trumpet', 'Sub Zero Project', 'Mathame']
+WORDS = ['arrival', 'everlight', 'petra', 'rolling', 'love', 'machine',
+         'analog', 'ascent', 'good', 'life', 'stereo', 'body', 'drum',
+         'dreams', 'bad', 'girl', 'timeshift', 'remix', 'extended', 'mix',
+         'night', 'signal', 'pulse', 'ritual', 'horizon', 'echo', 'velvet']
+QUERIES = ['tiesto', 'tiësto everlight', 'kre', 'matroda remix', 'good life',
+           'petra two lanes', 'ro', 'extended mix', 'velvet horizon', 'zzz']
+
+
+def random_title(rng):
+    words = ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4)))
+    title = f"{rng.choice(ARTISTS)} - {words}"
+    if rng.random() < 0.3:
+        title += f" ({rng.choice(ARTISTS)} Remix)"
+    return title
+
+
+def populate(conn, count, seed=1):
+    rng = random.Random(seed)
+    rows = ((random_title(rng), f"https://example.com/{i}") for i in range(count))
+    with conn:
+        conn.executemany('INSERT INTO tracks (title, url) VALUES (?, ?)', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark full-text track search on a synthetic catalog")
+    parser.add_argument('--tracks', type=int, default=100_000)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, 'bench.db'))
+        migrate(conn)
+        started = time.perf_counter()
+        populate(conn, args.tracks)
+        print(f"Inserted {args.tracks} tracks in "
+              f"{time.perf_counter() - started:.1f}s")
+
+        print(f"{'query':<20} {'hits':>5} {'median ms':>10} {'p95 ms':>8}")
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                results = search_tracks(conn, query)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(f"{query:<20} {len(results):>5} "
+                  f"{statistics.median(timings):>10.2f} {p95:>8.2f}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from semantic_cache import HashingEmbedder, default_embedder, evaluate
+
+# Fan questions labelled by what they ask, in the order they might arrive
+SAMPLE = [
+    ('What music do you play?', 'genre'),
+    ('When is your next gig?', 'next-gig'),
+    ('what music do you play', 'genre'),
+    ('How can I book you for my party?', 'booking'),
+    ('What genre do u play?', 'genre'),
+    ('whens ur next gig', 'next-gig'),
+    ('What kind of music do you play?', 'genre'),
+    ('How much does a booking cost?', 'booking-price'),
+    ('How do I book you?', 'booking'),
+    ('Where is your next show?', 'next-gig'),
+    ('Do you play techno?', 'techno'),
+    ('What music do you play at weddings?', 'weddings'),
+    ('Can I book you for a party?', 'booking'),
+    ('Do you play hardstyle?', 'hardstyle'),
+    ("What's your next gig?", 'next-gig'),
+    ('How much do you charge for a booking?', 'booking-price'),
+    ('Do you play techno music?', 'techno'),
+    ('what genres do you play', 'genre'),
+]
+
+
+def load(path):
+    """Read a JSONL log of {"question": ..., "intent": ...} objects."""
+    questions, intents = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                questions.append(record['question'])
+                intents.append(record.get('intent', record['question']))
+    return questions, intents
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay questions through the semantic cache and report "
+                    "hit rate and precision per similarity threshold")
+    parser.add_argument('log', nargs='?',
+                        help='JSONL with "question" and "intent" (default: built-in sample)')
+    parser.add_argument('--thresholds', default='0.6,0.7,0.75,0.8,0.85,0.9,0.95')
+    parser.add_argument('--hashing', action='store_true',
+                        help='use HashingEmbedder even if sentence-transformers is installed')
+    args = parser.parse_args()
+
+    if args.log:
+        questions, intents = load(args.log)
+    else:
+        questions, intents = [q for q, _ in SAMPLE], [i for _, i in SAMPLE]
+    embedder = HashingEmbedder() if args.hashing else default_embedder()
+    thresholds = [float(value) for value in args.thresholds.split(',')]
+
+    print(f"{len(questions)} questions, embedder {type(embedder).__name__}")
+    print(f"{'threshold':>9} {'hit rate':>9} {'precision':>10} {'wrong':>6}")
+    for row in evaluate(questions, intents, thresholds, embedder):
+        print(f"{row['threshold']:>9.2f} {row['hit_rate']:>9.1%} "
+              f"{row['precision']:>10.1%} {row['wrong']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+
+from precompress_assets import bundle_files
+
+ROOT = Path(__file__).resolve().parent.parent
+MANIFEST_NAME = 'asset-manifest.json'
+HASH_LENGTH = 8
+# Pages whose asset references are rewritten to the hashed names
+REWRITE_PATTERNS = ['*.html', 'service-worker.js']
+
+
+def hashed_name(name, data):
+    """Return e.g. assets/js/main.3f9a1c0d.js for assets/js/main.js."""
+    path = Path(name)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+def load_manifest(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_hashed_copies(root, names, previous):
+    """Copy each bundle file to its content-hashed name.
+
+    Hashed copies from the previous build that are no longer current are
+    removed. Returns the new original -> hashed manifest.
+    """
+    manifest = {}
+    for name in names:
+        source = root / name
+        if not source.is_file():
+            print(f"Skipping missing file {name}")
+            continue
+        data = source.read_bytes()
+        target = hashed_name(name, data)
+        if not (root / target).exists():
+            (root / target).write_bytes(data)
+        manifest[name] = target
+        old = previous.get(name)
+        if old and old != target:
+            for suffix in ('', '.gz', '.br'):
+                (root / (old + suffix)).unlink(missing_ok=True)
+    return manifest
+
+
+def rewrite_references(root, manifest, previous):
+    """Point asset references in pages at the hashed names.
+
+    Both original names and hashed names from the previous build are
+    replaced, so running the build again is safe. Returns the rewritten
+    files.
+    """
+    replacements = dict(manifest)
+    for name, old in previous.items():
+        if name in manifest:
+            replacements[old] = manifest[name]
+    if not replacements:
+        return []
+    alternatives = '|'.join(
+        re.escape(name) for name in sorted(replacements, key=len, reverse=True))
+    pattern = re.compile(rf'(?<=["\'(/])(?:{alternatives})(?=["\'?#)])')
+
+    rewritten = []
+    for glob in REWRITE_PATTERNS:
+        for page in sorted(root.glob(glob)):
+            text = page.read_text(encoding='utf-8')
+            updated = pattern.sub(lambda m: replacements[m.group(0)], text)
+            if updated != text:
+                page.write_text(updated, encoding='utf-8')
+                rewritten.append(page.name)
+    return rewritten
+
+
+def build(root, config_path):
+    root = Path(root)
+    manifest_path = root / MANIFEST_NAME
+    previous = load_manifest(manifest_path)
+    manifest = write_hashed_copies(root, bundle_files(config_path), previous)
+    rewritten = rewrite_references(root, manifest, previous)
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest, rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write content-hashed copies of bundled assets and point "
+                    "the HTML pages at them (run as part of a deploy build)")
+    parser.add_argument('--root', default=str(ROOT), help='Site root directory')
+    parser.add_argument('--config', default=None,
+                        help='Bundle config (defaults to <root>/bundle.config.json)')
+    args = parser.parse_args()
+    config = args.config or str(Path(args.root) / 'bundle.config.json')
+    manifest, rewritten = build(args.root, config)
+    print(f"Hashed {len(manifest)} asset(s), rewrote {len(rewritten)} page(s)")
+
+
+if __name__ == '__main__':
+    main()
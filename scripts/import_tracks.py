@@ -0,0 +1,34 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import DB_PATH, connect
+from migrations import migrate
+from tracks import IMPORT_CHUNK_SIZE, import_tracks, iter_records
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk-import tracks from a JSON array or NDJSON file")
+    parser.add_argument('source', help="File with {\"title\", \"url\"} records ('-' for stdin)")
+    parser.add_argument('--db', default=DB_PATH, help='Database path')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                        help='Rows per insert transaction')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    migrate(conn)
+    if args.source == '-':
+        result = import_tracks(conn, iter_records(sys.stdin), args.chunk_size)
+    else:
+        with open(args.source, encoding='utf-8') as f:
+            result = import_tracks(conn, iter_records(f), args.chunk_size)
+    conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,14 @@
 import os
-import sqlite3
+import sys
 
-DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(__file__), '..', 'data', 'app.db'))
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-conn = sqlite3.connect(DB_PATH)
-conn.execute('''
-CREATE TABLE IF NOT EXISTS tracks (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    title TEXT NOT NULL,
-    url TEXT NOT NULL
-)
-''')
-conn.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    password_hash TEXT NOT NULL,
-    is_premium BOOLEAN DEFAULT FALSE
-)
-''')
-conn.execute('''
-CREATE TABLE IF NOT EXISTS tokens (
-    token TEXT PRIMARY KEY,
-    user_id INTEGER NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-''')
-conn.execute('''
-CREATE TABLE IF NOT EXISTS forums (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    description TEXT,
-    premium_only BOOLEAN DEFAULT TRUE
-)
-''')
-conn.execute('''
-CREATE TABLE IF NOT EXISTS messages (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    forum_id INTEGER NOT NULL,
-    user_id INTEGER NOT NULL,
-    content TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(forum_id) REFERENCES forums(id),
-    FOREIGN KEY(user_id) REFERENCES users(id)
-)
-''')
-conn.commit()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import DB_PATH, connect
+from migrations import migrate
+
+# Opening through db.connect switches the file to WAL mode; migrate() then
+# applies whichever schema versions the database is missing.
+conn = connect(DB_PATH)
+version = migrate(conn)
 conn.close()
-print(f"Initialized database at {DB_PATH}")
+print(f"Initialized database at {DB_PATH} (schema version {version})")
@@ -0,0 +1,119 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz sidecars are written
+    brotli = None
+
+ROOT = Path(__file__).resolve().parent.parent
+MANIFEST_NAME = '.precompress-manifest.json'
+# Written by hash_assets.py; its hashed copies are compressed as well
+ASSET_MANIFEST_NAME = 'asset-manifest.json'
+
+
+def bundle_files(config_path):
+    """Return every file listed in bundle.config.json, without duplicates."""
+    config = json.loads(Path(config_path).read_text())
+    files = []
+    for section in config.values():
+        for entries in section.values():
+            for entry in entries:
+                if entry not in files:
+                    files.append(entry)
+    return files
+
+
+def hashed_files(root):
+    try:
+        manifest = json.loads((Path(root) / ASSET_MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return []
+    return list(manifest.values())
+
+
+def sidecar_paths(path):
+    paths = [path.with_name(path.name + '.gz')]
+    if brotli is not None:
+        paths.append(path.with_name(path.name + '.br'))
+    return paths
+
+
+def write_sidecars(path, data):
+    written = []
+    gz_path = path.with_name(path.name + '.gz')
+    # mtime=0 keeps the output byte-for-byte stable between runs
+    gz_path.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    written.append(gz_path)
+    if brotli is not None:
+        br_path = path.with_name(path.name + '.br')
+        br_path.write_bytes(brotli.compress(data, quality=11))
+        written.append(br_path)
+    return written
+
+
+def precompress(root, config_path, force=False):
+    """Write .gz/.br sidecars for bundle files whose content changed.
+
+    Content hashes from the previous run are kept in a manifest next to
+    the config, so unchanged files are skipped. Returns the list of
+    source files that were (re)compressed.
+    """
+    root = Path(root)
+    manifest_path = Path(config_path).with_name(MANIFEST_NAME)
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        manifest = {}
+
+    names = bundle_files(config_path)
+    names += [name for name in hashed_files(root) if name not in names]
+
+    changed = []
+    for name in names:
+        path = root / name
+        if not path.is_file():
+            print(f"Skipping missing file {name}")
+            continue
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        sidecars = sidecar_paths(path)
+        if not force and manifest.get(name) == digest and all(sidecar.exists() for sidecar in sidecars):
+            # The server ignores sidecars older than their source, so a
+            # touched but unchanged file (checkout, rsync) needs them
+            # touched too.
+            mtime = path.stat().st_mtime_ns
+            for sidecar in sidecars:
+                if sidecar.stat().st_mtime_ns < mtime:
+                    os.utime(sidecar, ns=(mtime, mtime))
+            continue
+        write_sidecars(path, data)
+        manifest[name] = digest
+        changed.append(name)
+
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate precompressed .gz/.br sidecars for bundled assets")
+    parser.add_argument('--root', default=str(ROOT), help='Site root directory')
+    parser.add_argument('--config', default=None,
+                        help='Bundle config (defaults to <root>/bundle.config.json)')
+    parser.add_argument('--force', action='store_true',
+                        help='Recompress every file even if unchanged')
+    args = parser.parse_args()
+    config = args.config or str(Path(args.root) / 'bundle.config.json')
+    changed = precompress(args.root, config, force=args.force)
+    if brotli is None:
+        print("brotli not installed; wrote .gz sidecars only")
+    print(f"Precompressed {len(changed)} changed file(s)")
+
+
+if __name__ == '__main__':
+    main()
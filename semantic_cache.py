@@ -0,0 +1,233 @@
+"""Reuse /api/ask answers for paraphrased questions.
+
+The exact cache (answer_cache) misses "what genre do u play" after "What
+music do you play?". This layer embeds each question locally, searches
+the questions answered before with cosine similarity, and reuses the
+answer of the closest one scoring at least SEMANTIC_CACHE_THRESHOLD.
+
+Embeddings come from sentence-transformers (SEMANTIC_CACHE_MODEL) when it
+is installed, otherwise from HashingEmbedder, which needs only NumPy. The
+index is a fixed-size NumPy matrix of SEMANTIC_CACHE_SIZE unit vectors.
+When it is full, expired entries are replaced first, then the least
+recently used. Set SEMANTIC_CACHE=1 to enable it. Pick the threshold for
+the embedder in use with scripts/eval_semantic_cache.py.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+from answer_cache import normalize_question
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency; the semantic cache stays off
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE', '0') == '1'
+SEMANTIC_CACHE_MODEL = os.getenv('SEMANTIC_CACHE_MODEL', 'all-MiniLM-L6-v2')
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 5000))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+')
+
+
+class HashingEmbedder:
+    """Words and character trigrams hashed into ``dim`` buckets.
+
+    Needs no model download. It matches rewordings that share words or
+    spelling ("whats ur next gig" / "What's your next gig?") but not
+    synonyms; use sentence-transformers for those.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _WORD_RE.findall(normalize_question(text)):
+                vectors[row, zlib.crc32(word.encode('utf-8')) % self.dim] += 1.0
+                padded = f' {word} '
+                for i in range(len(padded) - 2):
+                    trigram = padded[i:i + 3].encode('utf-8')
+                    vectors[row, zlib.crc32(b'#' + trigram) % self.dim] += 0.5
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceEmbedder:
+    """sentence-transformers model, loaded on first use."""
+
+    def __init__(self, model=SEMANTIC_CACHE_MODEL):
+        self.model_name = model
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            if self._model is None:
+                self._model = SentenceTransformer(self.model_name)
+        return np.asarray(self._model.encode(list(texts), normalize_embeddings=True),
+                          dtype=np.float32)
+
+
+def default_embedder():
+    if SentenceTransformer is not None:
+        return SentenceEmbedder()
+    return HashingEmbedder()
+
+
+def _scope_id(scope):
+    return zlib.crc32(scope.encode('utf-8'))
+
+
+class SemanticCache:
+    """Fixed-capacity cosine-similarity index of question -> answer.
+
+    Entries only match questions with the same ``scope`` (backend, model
+    and system prompt, as in the exact cache key). ``stats`` counts hits,
+    misses, stores and evictions.
+    """
+
+    def __init__(self, embedder=None, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_SIZE, ttl=SEMANTIC_CACHE_TTL,
+                 clock=time.time):
+        if np is None:
+            raise RuntimeError('numpy is required for the semantic cache')
+        self.embedder = embedder or default_embedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Allocated on the first store, once the embedding size is known
+        self._vectors = None
+        self._scopes = np.zeros(max_entries, dtype=np.int64)
+        self._created_at = np.zeros(max_entries)
+        self._used_at = np.zeros(max_entries)
+        self._occupied = np.zeros(max_entries, dtype=bool)
+        self._hits = np.zeros(max_entries, dtype=np.int64)
+        self._entries = [None] * max_entries
+
+    def lookup(self, question, scope=''):
+        """Return ``(answer, matched_question, score)`` or None."""
+        if self._vectors is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        vector = self.embedder([question])[0]
+        now = self._clock()
+        with self._lock:
+            live = (self._occupied & (self._scopes == _scope_id(scope))
+                    & (self._created_at > now - self.ttl))
+            if not live.any():
+                self.stats['misses'] += 1
+                return None
+            scores = self._vectors @ vector
+            scores[~live] = -np.inf
+            slot = int(np.argmax(scores))
+            score = float(scores[slot])
+            if score < self.threshold:
+                self.stats['misses'] += 1
+                return None
+            self._used_at[slot] = now
+            self._hits[slot] += 1
+            self.stats['hits'] += 1
+            matched_question, answer = self._entries[slot]
+        return answer, matched_question, score
+
+    def add(self, question, answer, scope=''):
+        vector = self.embedder([question])[0]
+        now = self._clock()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            slot = self._free_slot(now)
+            self._vectors[slot] = vector
+            self._scopes[slot] = _scope_id(scope)
+            self._created_at[slot] = self._used_at[slot] = now
+            self._occupied[slot] = True
+            self._hits[slot] = 0
+            self._entries[slot] = (question, answer)
+            self.stats['stores'] += 1
+
+    def top(self, limit=10):
+        """The most hit stored questions, as ``(question, hits)``."""
+        with self._lock:
+            slots = np.flatnonzero(self._occupied)
+            slots = slots[np.argsort(-self._hits[slots], kind='stable')][:limit]
+            return [(self._entries[slot][0], int(self._hits[slot])) for slot in slots]
+
+    def clear(self):
+        with self._lock:
+            self._occupied[:] = False
+            self._entries = [None] * self.max_entries
+
+    def __len__(self):
+        return int(self._occupied.sum())
+
+    def _free_slot(self, now):
+        free = np.flatnonzero(~self._occupied)
+        if free.size:
+            return int(free[0])
+        self.stats['evictions'] += 1
+        expired = np.flatnonzero(self._created_at <= now - self.ttl)
+        if expired.size:
+            return int(expired[0])
+        return int(np.argmin(self._used_at))
+
+
+def evaluate(questions, intents, thresholds, embedder=None):
+    """Replay ``questions`` through a semantic cache at each threshold.
+
+    ``intents`` labels what each question asks, so a hit whose matched
+    question has another intent counts as a wrong answer. Returns one
+    dict per threshold with the hit rate and the precision of the hits.
+    """
+    embedder = embedder or default_embedder()
+    vectors = embedder(list(questions))
+    index = {question: vector for question, vector in zip(questions, vectors)}
+
+    def memoized(texts):
+        return np.stack([index[text] for text in texts])
+
+    results = []
+    for threshold in thresholds:
+        cache = SemanticCache(embedder=memoized, threshold=threshold,
+                              max_entries=max(len(questions), 1), ttl=float('inf'))
+        hits = correct = 0
+        for question, intent in zip(questions, intents):
+            found = cache.lookup(question)
+            if found is None:
+                cache.add(question, intent)
+                continue
+            hits += 1
+            correct += found[0] == intent
+        results.append({
+            'threshold': threshold,
+            'hit_rate': hits / len(questions) if questions else 0.0,
+            'precision': correct / hits if hits else 1.0,
+            'hits': hits,
+            'wrong': hits - correct,
+        })
+    return results
+
+
+semantic_cache = None
+if SEMANTIC_CACHE_ENABLED:
+    if np is None:
+        logger.warning('SEMANTIC_CACHE=1 but numpy is not installed; disabled')
+    else:
+        semantic_cache = SemanticCache()
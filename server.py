@@ -1,9 +1,170 @@
 #!/usr/bin/env python3
+import datetime
+import email.utils
+import hashlib
 import http.server
+import io
+import re
 import socketserver
 import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+from http import HTTPStatus
+
+PORT = int(os.environ.get('PORT', 8000))
+# Number of requests handled at once; 0 falls back to the single-threaded
+# development server.
+WORKERS = int(os.environ.get('SERVER_WORKERS', 8))
+# Seconds an idle keep-alive connection is kept open.
+KEEP_ALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEP_ALIVE_TIMEOUT', 15))
+
+# Only a single byte range is supported; anything else (multiple ranges,
+# other units) is ignored and the whole file is sent with a 200.
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Maximum number of files whose content hash is remembered for ETags.
+ETAG_CACHE_SIZE = int(os.environ.get('SERVER_ETAG_CACHE_SIZE', 2048))
+# In-memory response cache: total byte budget (0 disables it) and the
+# largest file that may be held in memory.
+RESPONSE_CACHE_BYTES = int(os.environ.get('SERVER_CACHE_BYTES', 32 * 1024 * 1024))
+RESPONSE_CACHE_MAX_FILE = int(os.environ.get('SERVER_CACHE_MAX_FILE', 256 * 1024))
+
+# Precompressed sidecars (see scripts/precompress_assets.py), in order of
+# preference. Only served when at least as new as the original file.
+SIDECAR_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'image/svg+xml')
+# Content-hashed copies written by scripts/hash_assets.py never change, so
+# browsers may cache them for a year without revalidating.
+HASHED_ASSET_RE = re.compile(r'\.[0-9a-f]{8}\.(?:js|css)(?:\.gz|\.br)?$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class ETagCache:
+    """Bounded LRU map of path -> (size, mtime, content hash).
+
+    An entry is reused while the file's size and mtime are unchanged, so a
+    revalidation only costs a stat() instead of re-reading the file.
+    """
+
+    def __init__(self, max_entries=ETAG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, st):
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                return entry[1]
+        etag = make_etag(self._hash_file(path))
+        with self._lock:
+            self._entries[path] = (key, etag)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+class CachedResponse:
+    __slots__ = ('key', 'body', 'etag', 'mtime', 'header_block')
+
+    def __init__(self, key, body, etag, mtime, header_block):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.mtime = mtime
+        # Encoded entity headers, written to the socket as-is on a hit
+        self.header_block = header_block
+
+
+class ResponseCache:
+    """LRU cache of small file bodies and their headers under a byte budget.
+
+    Entries are keyed by path and dropped as soon as the file's size or
+    mtime no longer match, so edits show up on the next request.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES,
+                 max_file_size=RESPONSE_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def accepts(self, st):
+        return 0 < self.max_bytes and st.st_size <= min(self.max_file_size,
+                                                        self.max_bytes)
+
+    def get(self, path, st):
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.key == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(path)
+            self.misses += 1
+            return None
+
+    def put(self, path, entry):
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = entry
+            self.current_bytes += len(entry.body)
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _remove(self, path):
+        entry = self._entries.pop(path)
+        self.current_bytes -= len(entry.body)
+
+
+def make_etag(hexdigest):
+    return '"%s"' % hexdigest[:32]
+
+
+ETAG_CACHE = ETagCache()
+RESPONSE_CACHE = ResponseCache()
 
-PORT = 8000
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
@@ -24,18 +185,299 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.path = '/index.html'
         return super().do_GET()
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
-    print(f"Server running at http://localhost:{PORT}/")
-    print(f"Directory: {os.getcwd()}")
-    print("\nSecurity features enabled:")
-    print("- Content Security Policy active")
-    print("- Frame options set to DENY")
-    print("- Content type sniffing disabled")
-    print("\nPress Ctrl+C to stop the server")
-    
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nServer stopped.")
+    def send_head(self):
+        self._body_length = None
+        path = self._resolve_file()
+        if path is None:
+            # Directories, redirects and 404s keep the stock behaviour
+            return super().send_head()
+        ctype = self.guess_type(path)
+        encoding, path = self._select_variant(path, ctype)
+        try:
+            st = os.stat(path)
+            if RESPONSE_CACHE.accepts(st) and "Range" not in self.headers:
+                return self._send_cached_head(path, st, ctype, encoding)
+            etag = ETAG_CACHE.get(path, st)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        # Revalidations are answered from the stat and cached hash alone
+        if self._not_modified(etag, st.st_mtime):
+            self._send_not_modified(path, ctype, etag)
+            return None
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        try:
+            return self._send_file_head(f, path, ctype, encoding)
+        except Exception:
+            f.close()
+            raise
+
+    def _resolve_file(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not urllib.parse.urlsplit(self.path).path.endswith('/'):
+                return None
+            for index in "index.html", "index.htm":
+                index = os.path.join(path, index)
+                if os.path.isfile(index):
+                    return index
+            return None
+        if path.endswith('/') or not os.path.isfile(path):
+            return None
+        return path
+
+    def _send_cached_head(self, path, st, ctype, encoding):
+        entry = RESPONSE_CACHE.get(path, st)
+        if entry is None:
+            entry = RESPONSE_CACHE.put(
+                path, self._build_cached_response(path, ctype, encoding))
+        if self._not_modified(entry.etag, entry.mtime):
+            self._send_not_modified(path, ctype, entry.etag)
+            return None
+        self.send_response(HTTPStatus.OK)
+        # send_response() has initialised the header buffer
+        self._headers_buffer.append(entry.header_block)
+        self.end_headers()
+        self._body_length = len(entry.body)
+        return io.BytesIO(entry.body)
+
+    def _send_not_modified(self, path, ctype, etag):
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_header("ETag", etag)
+        if ctype.startswith(COMPRESSIBLE_TYPES):
+            self.send_header("Vary", "Accept-Encoding")
+        if HASHED_ASSET_RE.search(path):
+            self.send_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+        self.end_headers()
+
+    def _build_cached_response(self, path, ctype, encoding):
+        with open(path, 'rb') as f:
+            fs = os.fstat(f.fileno())
+            body = f.read()
+        etag = make_etag(hashlib.sha256(body).hexdigest())
+        headers = [("Content-type", ctype)]
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        if ctype.startswith(COMPRESSIBLE_TYPES):
+            headers.append(("Vary", "Accept-Encoding"))
+        headers += [
+            ("Content-Length", str(len(body))),
+            ("Last-Modified", self.date_time_string(fs.st_mtime)),
+            ("ETag", etag),
+            ("Accept-Ranges", "bytes"),
+        ]
+        if HASHED_ASSET_RE.search(path):
+            headers.append(("Cache-Control", IMMUTABLE_CACHE_CONTROL))
+        header_block = b"".join(
+            ("%s: %s\r\n" % header).encode('latin-1', 'strict')
+            for header in headers)
+        return CachedResponse((fs.st_size, fs.st_mtime_ns), body, etag,
+                              fs.st_mtime, header_block)
+
+    def _select_variant(self, path, ctype):
+        """Pick a precompressed sidecar the client accepts, if one exists."""
+        if not ctype.startswith(COMPRESSIBLE_TYPES):
+            return None, path
+        accepted = self._accepted_encodings()
+        try:
+            mtime = os.stat(path).st_mtime
+            for encoding, suffix in SIDECAR_ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                try:
+                    if os.stat(path + suffix).st_mtime >= mtime:
+                        return encoding, path + suffix
+                except OSError:
+                    continue
+        except OSError:
+            pass
+        return None, path
+
+    def _accepted_encodings(self):
+        accepted = set()
+        for item in self.headers.get("Accept-Encoding", "").split(","):
+            coding, _, params = item.strip().partition(";")
+            coding = coding.strip().lower()
+            q = params.strip()
+            if q.startswith("q="):
+                try:
+                    if float(q[2:]) <= 0:
+                        continue
+                except ValueError:
+                    continue
+            if coding:
+                accepted.add(coding)
+        if "*" in accepted:
+            accepted.update(encoding for encoding, _ in SIDECAR_ENCODINGS)
+        return accepted
+
+    def _send_file_head(self, f, path, ctype, encoding=None):
+        fs = os.fstat(f.fileno())
+        size = fs.st_size
+        last_modified = self.date_time_string(fs.st_mtime)
+        etag = ETAG_CACHE.get(path, fs)
+
+        try:
+            byte_range = self._requested_range(size, etag, last_modified)
+        except RangeNotSatisfiable:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            f.close()
+            return None
+
+        if byte_range is None:
+            self.send_response(HTTPStatus.OK)
+            self._body_length = size
+        else:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self._body_length = end - start + 1
+            f.seek(start)
+        self.send_header("Content-type", ctype)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if ctype.startswith(COMPRESSIBLE_TYPES):
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(self._body_length))
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        if HASHED_ASSET_RE.search(path):
+            self.send_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+        self.end_headers()
+        return f
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # If-None-Match uses weak comparison and overrides If-Modified-Since
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or any(
+                tag[2:] == etag if tag.startswith("W/") else tag == etag
+                for tag in tags)
+        if "If-Modified-Since" not in self.headers:
+            return False
+        try:
+            ims = email.utils.parsedate_to_datetime(
+                self.headers["If-Modified-Since"])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if ims.tzinfo is None:
+            ims = ims.replace(tzinfo=datetime.timezone.utc)
+        last_modif = datetime.datetime.fromtimestamp(
+            mtime, datetime.timezone.utc).replace(microsecond=0)
+        return last_modif <= ims
+
+    def _requested_range(self, size, etag, last_modified):
+        """Return the (start, end) byte range to send, or None for the
+        whole file. Raises RangeNotSatisfiable for ranges past the end."""
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        # If-Range only holds when the validator matches exactly
+        if_range = self.headers.get("If-Range")
+        if if_range is not None and if_range.strip() not in (etag, last_modified):
+            return None
+        match = RANGE_RE.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the final N bytes
+            suffix = int(last)
+            if suffix == 0:
+                raise RangeNotSatisfiable()
+            start = max(size - suffix, 0)
+            end = size - 1
+        if start >= size:
+            raise RangeNotSatisfiable()
+        return start, min(end, size - 1)
+
+    def copyfile(self, source, outputfile):
+        if outputfile is not self.wfile:
+            return super().copyfile(source, outputfile)
+        if isinstance(source, io.BytesIO):
+            outputfile.write(source.getbuffer())
+            return
+        # socket.sendfile uses zero-copy os.sendfile where the platform
+        # supports it and falls back to plain send() otherwise
+        self.connection.sendfile(source, source.tell(), self._body_length)
+
+
+class KeepAliveHTTPRequestHandler(MyHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open between requests, so a page and
+    # its CSS/JS/image subrequests share one socket.
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    # Only preparing a response (stat, hashing, opening or caching the
+    # file) takes one of the server's request slots. Waiting on an idle
+    # connection and sending the body to a slow client do not.
+    def send_head(self):
+        with self.server.request_slots:
+            return super().send_head()
+
+
+class PooledHTTPServer(http.server.ThreadingHTTPServer):
+    """HTTP server preparing at most ``workers`` responses at a time.
+
+    Each connection gets its own thread, so idle keep-alive connections
+    and slow downloads cost a sleeping thread rather than a worker. The
+    work of building responses shares ``workers`` slots.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.request_slots = threading.BoundedSemaphore(workers)
+
+
+def create_server(port=PORT, workers=WORKERS):
+    if workers > 0:
+        return PooledHTTPServer(("", port), KeepAliveHTTPRequestHandler, workers)
+    return socketserver.TCPServer(("", port), MyHTTPRequestHandler)
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    with create_server() as httpd:
+        print(f"Server running at http://localhost:{PORT}/")
+        print(f"Directory: {os.getcwd()}")
+        if WORKERS > 0:
+            print(f"Mode: threaded, {WORKERS} concurrent requests, HTTP/1.1 keep-alive")
+        else:
+            print("Mode: single-threaded development server")
+        if RESPONSE_CACHE.max_bytes:
+            print(f"Response cache: {RESPONSE_CACHE.max_bytes} bytes, "
+                  f"files up to {RESPONSE_CACHE.max_file_size} bytes")
+        print("\nSecurity features enabled:")
+        print("- Content Security Policy active")
+        print("- Frame options set to DENY")
+        print("- Content type sniffing disabled")
+        print("\nPress Ctrl+C to stop the server")
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+            if RESPONSE_CACHE.max_bytes:
+                print(f"Response cache: {RESPONSE_CACHE.stats()}")
+
+
+if __name__ == '__main__':
+    main()
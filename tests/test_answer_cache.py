@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import answer_cache
+import db
+import migrations
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "app.db")
+    connection = db.connect(path)
+    migrations.migrate(connection)
+    connection.close()
+    yield path
+    db.get_pool(path).close()
+
+
+@pytest.mark.parametrize("question", [
+    "What music do you play?",
+    "what music do you play",
+    "  WHAT   music, do you play?! ",
+    "ｗｈａｔ music do you play？",
+])
+def test_normalized_questions_share_a_key(question):
+    expected = answer_cache.cache_key("What music do you play?", "openai", "gpt", "prompt")
+    assert answer_cache.cache_key(question, "openai", "gpt", "prompt") == expected
+
+
+def test_key_depends_on_backend_model_and_prompt():
+    keys = {answer_cache.cache_key("q", *parts) for parts in [
+        ("openai", "gpt", "prompt"), ("gemini", "gpt", "prompt"),
+        ("openai", "gpt-4", "prompt"), ("openai", "gpt", "other prompt")]}
+    assert len(keys) == 4
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = answer_cache.AnswerCache(ttl=60, clock=clock, persist=False)
+    cache.put("k", "answer")
+    clock.now += 59
+    assert cache.get("k") == "answer"
+    clock.now += 2
+    assert cache.get("k") is None
+    assert (cache.stats["hits"], cache.stats["misses"]) == (1, 1)
+
+
+def test_lru_bound_and_hit_counters():
+    cache = answer_cache.AnswerCache(max_entries=2, persist=False)
+    cache.put("a", "A", question="booking?")
+    cache.put("b", "B", question="genre?")
+    for _ in range(3):
+        cache.get("b")
+    cache.get("a")
+    cache.put("c", "C", question="next gig?")
+    assert cache.get("b") is None
+    assert cache.stats["evictions"] == 1
+    assert cache.top(1) == [("booking?", "", 1)]
+
+
+def test_size_zero_disables_the_cache():
+    cache = answer_cache.AnswerCache(max_entries=0, persist=False)
+    cache.put("k", "answer")
+    assert cache.get("k") is None
+
+
+def test_persistent_tier_is_shared_and_counts_hits(path, monkeypatch):
+    monkeypatch.setattr(answer_cache, "HIT_FLUSH_THRESHOLD", 2)
+    clock = FakeClock()
+    writer = answer_cache.AnswerCache(persist=True, path=path, ttl=60, clock=clock)
+    writer.put("k", "answer", question="What music?", backend="openai")
+
+    reader = answer_cache.AnswerCache(persist=True, path=path, ttl=60, clock=clock)
+    assert reader.get("k") == "answer"
+    assert reader.get("k") == "answer"
+    conn = db.get_connection(path)
+    assert conn.execute("SELECT hits FROM answer_cache").fetchone()[0] == 2
+
+    clock.now += 61
+    assert answer_cache.AnswerCache(persist=True, path=path, ttl=60, clock=clock).get("k") is None
+    assert reader.purge_expired() == 1
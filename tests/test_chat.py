@@ -0,0 +1,155 @@
+import json
+import os
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import answer_cache
+import chat
+
+
+def fake_backend(pieces=("Hard", "style", "!"), error=None):
+    def ask_stream(question):
+        for piece in pieces:
+            yield piece
+        if error:
+            raise error
+    return types.SimpleNamespace(
+        ask=lambda question: {"text": "".join(pieces)},
+        ask_stream=ask_stream,
+    )
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    backends = {"fake": fake_backend(),
+                "broken": fake_backend(("Half",), RuntimeError("upstream closed")),
+                "openai": types.SimpleNamespace(ask=lambda question: {
+                    "id": "1", "choices": [{"message": {"content": "from openai"}}]})}
+    monkeypatch.setattr(chat, "BACKENDS", backends)
+    chat.answer_cache.clear()
+    yield backends
+    chat.answer_cache.clear()
+
+
+def test_ask_keeps_text_contract(backends):
+    assert chat.ask("q", "fake") == {"text": "Hardstyle!"}
+    assert chat.ask("q", "openai") == {"text": "from openai"}
+    with pytest.raises(ValueError):
+        chat.ask("q", "nope")
+
+
+def test_sse_events(backends):
+    body = "".join(chat.sse_events(chat.ask_stream("q", "fake", chat.StreamMetrics())))
+    events = body.split("\n\n")[:-1]
+    assert events[0] == 'data: {"text": "Hard"}'
+    assert len(events) == 4
+    assert events[-1].startswith("event: done\n")
+    assert json.loads(events[-1].split("data: ", 1)[1]) == {"text": "Hardstyle!", "done": True}
+
+
+def test_sse_error_event(backends):
+    metrics = chat.StreamMetrics()
+    body = "".join(chat.sse_events(chat.ask_stream("q", "broken", metrics)))
+    assert body.endswith('event: error\ndata: {"error": "AI request failed"}\n\n')
+    assert "upstream closed" not in body
+    assert metrics.summary()["broken"] == {"streams": 0, "errors": 1}
+
+
+def test_ndjson_lines(backends):
+    lines = list(chat.ndjson_lines(chat.ask_stream("q", "fake", chat.StreamMetrics())))
+    assert [json.loads(line) for line in lines] == [
+        {"text": "Hard"}, {"text": "style"}, {"text": "!"},
+        {"text": "Hardstyle!", "done": True}]
+    assert all(line.endswith("\n") for line in lines)
+
+
+def test_time_to_first_token_is_recorded(backends):
+    metrics = chat.StreamMetrics(window=2)
+    no_cache = answer_cache.AnswerCache(max_entries=0)
+    for _ in range(3):
+        list(chat.ask_stream("q", "fake", metrics, cache=no_cache))
+    summary = metrics.summary()["fake"]
+    assert summary["streams"] == 2
+    assert 0 <= summary["ttft_p50_ms"] <= summary["total_p50_ms"]
+
+
+@pytest.mark.parametrize("accept, requested, expected", [
+    ("application/json", None, None),
+    ("", None, None),
+    ("text/event-stream", None, "sse"),
+    ("application/x-ndjson", None, "ndjson"),
+    ("application/json", "1", "sse"),
+    ("application/json", "ndjson", "ndjson"),
+    ("text/event-stream", "0", None),
+])
+def test_stream_format(accept, requested, expected):
+    assert chat.stream_format(accept, requested) == expected
+
+
+def counting_backend(answer="We play techno."):
+    calls = []
+
+    def ask(question):
+        calls.append(question)
+        return {"text": answer}
+
+    def ask_stream(question):
+        calls.append(question)
+        yield from answer.partition(" ")
+
+    return calls, types.SimpleNamespace(ask=ask, ask_stream=ask_stream,
+                                        SYSTEM_PROMPT="You are a DJ.")
+
+
+def test_repeat_questions_are_answered_from_cache(backends):
+    calls, backends["dj"] = counting_backend()
+    assert chat.ask("What music do you play?", "dj") == {"text": "We play techno."}
+    assert chat.ask("  what MUSIC do you play ", "dj") == {"text": "We play techno."}
+    assert calls == ["What music do you play?"]
+
+
+def test_cache_key_covers_backend_and_system_prompt(backends):
+    calls, backends["dj"] = counting_backend()
+    other_calls, backends["other"] = counting_backend("Gemini says hi")
+    chat.ask("hello", "dj")
+    assert chat.ask("hello", "other") == {"text": "Gemini says hi"}
+    backends["dj"].SYSTEM_PROMPT = "You are a booking agent."
+    chat.ask("hello", "dj")
+    assert len(calls) == 2 and len(other_calls) == 1
+
+
+def test_streamed_answers_are_cached(backends):
+    calls, backends["dj"] = counting_backend()
+    assert list(chat.ask_stream("What music?", "dj", chat.StreamMetrics())) == \
+        ["We", " ", "play techno."]
+    assert list(chat.ask_stream("what music", "dj", chat.StreamMetrics())) == \
+        ["We play techno."]
+    assert chat.ask("What music", "dj") == {"text": "We play techno."}
+    assert calls == ["What music?"]
+
+
+def test_failed_stream_is_not_cached(backends):
+    with pytest.raises(RuntimeError):
+        list(chat.ask_stream("q", "broken", chat.StreamMetrics()))
+    assert len(chat.answer_cache) == 0
+
+
+def test_empty_answers_are_not_cached(backends):
+    calls, backends["dj"] = counting_backend("")
+    assert chat.ask("hello", "dj") == {"text": ""}
+    assert list(chat.ask_stream("hello", "dj", chat.StreamMetrics())) == ["", "", ""]
+    assert chat.ask("hello", "dj") == {"text": ""}
+    assert len(calls) == 3
+    assert len(chat.answer_cache) == 0
+
+
+def test_null_openai_content_is_returned_uncached(backends):
+    completions = [{"choices": [{"message": {"content": None, "refusal": "I can't help."}}]},
+                   {"choices": [{"message": {"content": None, "tool_calls": []}}]}]
+    backends["openai-like"] = types.SimpleNamespace(ask=lambda question: completions.pop(0))
+    assert chat.ask("hello", "openai-like") == {"text": "I can't help."}
+    assert chat.ask("hello", "openai-like") == {"text": ""}
+    assert len(chat.answer_cache) == 0
@@ -0,0 +1,86 @@
+import gc
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import db
+
+
+def test_connect_applies_pragmas(tmp_path):
+    conn = db.connect(str(tmp_path / "app.db"))
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == db.BUSY_TIMEOUT_MS
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -db.CACHE_SIZE_KIB
+    finally:
+        conn.close()
+
+
+def test_pool_reuses_connection_per_thread(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / "app.db"))
+    try:
+        main_conn = pool.connection()
+        assert pool.connection() is main_conn
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not main_conn
+    finally:
+        pool.close()
+
+
+def test_pool_closes_connections_of_finished_threads(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / "app.db"))
+    opened = []
+    try:
+        main_conn = pool.connection()
+        for _ in range(20):
+            thread = threading.Thread(target=lambda: opened.append(pool.connection()))
+            thread.start()
+            thread.join()
+        gc.collect()
+        assert len(pool) == 1
+        with pytest.raises(sqlite3.ProgrammingError):
+            opened[0].execute("SELECT 1")
+        main_conn.execute("SELECT 1")
+    finally:
+        pool.close()
+
+
+def test_readers_are_not_blocked_by_open_write(tmp_path):
+    path = str(tmp_path / "app.db")
+    writer = db.connect(path)
+    writer.execute("CREATE TABLE tracks (id INTEGER PRIMARY KEY, title TEXT)")
+    writer.execute("INSERT INTO tracks (title) VALUES ('a')")
+    writer.commit()
+
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("INSERT INTO tracks (title) VALUES ('b')")
+    reader = db.connect(path)
+    try:
+        # With WAL the reader sees the last committed state immediately
+        assert reader.execute("SELECT COUNT(*) FROM tracks").fetchone()[0] == 1
+    finally:
+        writer.rollback()
+        reader.close()
+        writer.close()
+
+
+def test_init_db_creates_wal_database(tmp_path):
+    path = str(tmp_path / "app.db")
+    env = dict(os.environ, DB_PATH=path)
+    subprocess.run([sys.executable, "scripts/init_db.py"], env=env, check=True,
+                   stdout=subprocess.PIPE)
+    conn = db.connect(path)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        conn.close()
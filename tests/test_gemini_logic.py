@@ -1,13 +1,22 @@
 import os
 import sys
+import threading
 from unittest.mock import patch, MagicMock
 import pytest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import gemini_logic
 from gemini_logic import ask, SYSTEM_PROMPT
 
 
+@pytest.fixture(autouse=True)
+def fresh_models():
+    gemini_logic.models.clear()
+    yield
+    gemini_logic.models.clear()
+
+
 def test_gemini_ask_success():
     with patch("gemini_logic.genai") as mock_genai:
         model = mock_genai.GenerativeModel.return_value
@@ -42,3 +51,55 @@ def test_gemini_ask_error():
 
         with pytest.raises(RuntimeError):
             ask("Hi", "sk-test")
+
+
+def test_gemini_model_is_reused_across_calls():
+    with patch("gemini_logic.genai") as mock_genai:
+        model = mock_genai.GenerativeModel.return_value
+        model.generate_content.return_value = MagicMock(text="hi")
+
+        ask("one", "sk-test")
+        ask("two", "sk-test")
+
+        assert mock_genai.configure.call_count == 1
+        assert mock_genai.GenerativeModel.call_count == 1
+        assert model.generate_content.call_count == 2
+        assert model._client is mock_genai.client.get_default_generative_client.return_value
+
+
+def test_gemini_models_are_per_api_key():
+    with patch("gemini_logic.genai") as mock_genai:
+        mock_genai.GenerativeModel.side_effect = lambda *args, **kwargs: MagicMock()
+
+        first = gemini_logic.models.get("key-a")
+        second = gemini_logic.models.get("key-b")
+
+        assert first is not second
+        assert gemini_logic.models.get("key-a") is first
+        assert [c.kwargs["api_key"] for c in mock_genai.configure.call_args_list] == \
+            ["key-a", "key-b"]
+
+
+def test_gemini_concurrent_first_calls_build_one_model():
+    with patch("gemini_logic.genai") as mock_genai:
+        mock_genai.GenerativeModel.side_effect = lambda *args, **kwargs: MagicMock()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(gemini_logic.models.get("k")))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        assert mock_genai.GenerativeModel.call_count == 1
+        assert all(result is results[0] for result in results)
+
+
+def test_gemini_ask_stream():
+    with patch("gemini_logic.genai") as mock_genai:
+        model = mock_genai.GenerativeModel.return_value
+        model.generate_content.return_value = iter(
+            [MagicMock(text="Hard"), MagicMock(text=""), MagicMock(text="style")])
+
+        assert list(gemini_logic.ask_stream("Hi", "sk-test")) == ["Hard", "style"]
+        model.generate_content.assert_called_with("Hi", stream=True)
@@ -1,5 +1,11 @@
+import gc
 import os
+import queue
 import sys
+import threading
+import time
+import types
+import weakref
 import pytest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
@@ -42,3 +48,281 @@ def test_hf_ask_error(monkeypatch):
     monkeypatch.setattr(huggingface_logic, 'pipeline', fake_pipeline)
     with pytest.raises(RuntimeError):
         huggingface_logic.ask("Hi", "bad-model")
+
+
+class FakePipe:
+    def __init__(self, model):
+        self.model_name = model
+
+    def __call__(self, prompt, max_new_tokens=20, batch_size=None):
+        # Like a real pipeline: a list of prompts gives a list of outputs
+        if isinstance(prompt, list):
+            return [self(item, max_new_tokens) for item in prompt]
+        return [{"generated_text": f"{self.model_name}: {prompt}"}]
+
+
+def test_pipeline_is_loaded_once(monkeypatch):
+    loads = []
+
+    def fake_pipeline(task, model=None):
+        loads.append(model)
+        return FakePipe(model)
+    monkeypatch.setattr(huggingface_logic, 'pipeline', fake_pipeline)
+    monkeypatch.setattr(huggingface_logic, 'registry', huggingface_logic.PipelineRegistry())
+    assert huggingface_logic.ask("one", "m")["text"] == "m: one"
+    assert huggingface_logic.ask("two", "m")["text"] == "m: two"
+    assert loads == ["m"]
+
+
+def test_failed_load_is_not_cached():
+    attempts = []
+
+    def loader(model):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise RuntimeError("download failed")
+        return FakePipe(model)
+    registry = huggingface_logic.PipelineRegistry(loader=loader)
+    with pytest.raises(RuntimeError):
+        registry.get("m")
+    assert registry.generate("m", "hi")[0]["generated_text"] == "m: hi"
+    assert attempts == ["m", "m"]
+
+
+def test_registry_evicts_least_recently_used_by_size():
+    sizes = {"a": 40, "b": 40, "c": 40}
+    registry = huggingface_logic.PipelineRegistry(
+        max_bytes=100, loader=FakePipe, sizer=lambda pipe: sizes[pipe.model_name])
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    assert "b" not in registry
+    assert "a" in registry and "c" in registry
+    assert (registry.loads, registry.evictions) == (3, 1)
+
+
+def test_concurrent_first_requests_load_once():
+    loads = []
+
+    def slow_loader(model):
+        loads.append(model)
+        time.sleep(0.1)
+        return FakePipe(model)
+    registry = huggingface_logic.PipelineRegistry(loader=slow_loader)
+    threads = [threading.Thread(target=registry.generate, args=("m", "hi"))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert loads == ["m"]
+
+
+def test_warm_loads_hf_model(monkeypatch):
+    monkeypatch.setenv("HF_MODEL", "warm-model")
+    registry = huggingface_logic.PipelineRegistry(loader=FakePipe)
+    registry.warm()
+    assert "warm-model" in registry
+
+
+class RecordingPipe(FakePipe):
+    def __init__(self, model="m", error=None):
+        super().__init__(model)
+        self.calls = []
+        self.error = error
+
+    def __call__(self, prompt, max_new_tokens=20, batch_size=None):
+        if batch_size is not None or not isinstance(prompt, list):
+            self.calls.append(prompt)
+        if self.error:
+            raise self.error
+        return super().__call__(prompt, max_new_tokens, batch_size)
+
+
+def submit_all(batcher, prompts, **kwargs):
+    results, errors = {}, []
+
+    def target(prompt):
+        try:
+            results[prompt] = batcher.submit(prompt, **kwargs)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=target, args=(prompt,)) for prompt in prompts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_batcher_runs_concurrent_prompts_together():
+    pipe = RecordingPipe()
+    batcher = huggingface_logic.MicroBatcher(pipe, max_batch=4, max_wait=0.2)
+    prompts = ["a", "b", "c", "d"]
+    results, errors = submit_all(batcher, prompts)
+    assert not errors
+    for prompt in prompts:
+        assert results[prompt] == [{"generated_text": f"m: {prompt}"}]
+    assert (batcher.batches, batcher.prompts) == (1, 4)
+    assert sorted(pipe.calls[0]) == prompts
+
+
+def test_batcher_respects_max_batch():
+    batcher = huggingface_logic.MicroBatcher(RecordingPipe(), max_batch=2, max_wait=0.05)
+    results, errors = submit_all(batcher, ["a", "b", "c", "d", "e"])
+    assert len(results) == 5 and not errors
+    assert batcher.batches >= 3
+
+
+def test_lone_prompt_waits_at_most_max_wait():
+    pipe = RecordingPipe()
+    batcher = huggingface_logic.MicroBatcher(pipe, max_batch=8, max_wait=0.05)
+    started = time.monotonic()
+    assert batcher.submit("solo") == [{"generated_text": "m: solo"}]
+    assert time.monotonic() - started < 1
+    assert pipe.calls == ["solo"]
+
+
+def test_batch_error_reaches_every_caller():
+    batcher = huggingface_logic.MicroBatcher(
+        RecordingPipe(error=RuntimeError("oom")), max_batch=3, max_wait=0.2)
+    results, errors = submit_all(batcher, ["a", "b", "c"])
+    assert not results
+    assert len(errors) == 3
+
+
+def test_batches_do_not_mix_generation_arguments():
+    pipe = RecordingPipe()
+    batcher = huggingface_logic.MicroBatcher(pipe, max_batch=4, max_wait=0.1)
+    threads = [threading.Thread(target=batcher.submit, args=(f"p{tokens}",),
+                                kwargs={"max_new_tokens": tokens})
+               for tokens in (10, 20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert batcher.batches == 2
+
+
+def test_batch_size_one_calls_the_pipeline_directly():
+    registry = huggingface_logic.PipelineRegistry(loader=FakePipe, max_batch=1)
+    assert registry.get("m").batcher is None
+    assert registry.generate("m", "hi") == [{"generated_text": "m: hi"}]
+
+
+def test_evicted_pipeline_is_garbage_collected():
+    registry = huggingface_logic.PipelineRegistry(
+        max_bytes=50, loader=FakePipe, sizer=lambda pipe: 40)
+    registry.generate("a", "hi")
+    batcher = registry.get("a").batcher
+    evicted = weakref.ref(registry.get("a").pipe)
+    registry.generate("b", "hi")
+    assert "a" not in registry
+
+    batcher._thread.join(5)
+    assert not batcher._thread.is_alive()
+    del batcher
+    gc.collect()
+    assert evicted() is None
+
+
+def test_stopped_batcher_answers_queued_and_late_prompts():
+    pipe = RecordingPipe()
+    batcher = huggingface_logic.MicroBatcher(pipe, max_batch=4, max_wait=0.2)
+    results = {}
+    thread = threading.Thread(
+        target=lambda: results.setdefault("queued", batcher.submit("queued")))
+    thread.start()
+    time.sleep(0.05)
+    batcher.stop()
+    thread.join(5)
+    batcher._thread.join(5)
+    assert results["queued"] == [{"generated_text": "m: queued"}]
+    assert not batcher._thread.is_alive()
+    assert batcher.submit("late") == [{"generated_text": "m: late"}]
+
+
+def test_clear_stops_batcher_threads():
+    registry = huggingface_logic.PipelineRegistry(loader=FakePipe)
+    registry.generate("m", "hi")
+    batcher = registry.get("m").batcher
+    registry.clear()
+    batcher._thread.join(5)
+    assert not batcher._thread.is_alive()
+
+
+class FakeStreamer:
+    """Queue-backed stand-in for transformers' TextIteratorStreamer."""
+
+    def __init__(self, tokenizer, **kwargs):
+        self.queue = queue.Queue()
+
+    def put(self, text):
+        self.queue.put(text)
+
+    def end(self):
+        self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            text = self.queue.get(timeout=5)
+            if text is None:
+                return
+            yield text
+
+
+class FakeTokenizer:
+    pad_token_id = 0
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.calls = []
+
+    def __call__(self, prompt, return_tensors=None):
+        self.calls.append(prompt)
+        self.pipe.record_lock("tokenize")
+        return {"input_ids": prompt}
+
+
+class StreamingPipe(FakePipe):
+    def __init__(self, model, error=None):
+        super().__init__(model)
+        self.error = error
+        self.tokenizer = FakeTokenizer(self)
+        self.model = types.SimpleNamespace(generate=self.generate)
+        self.lock_held = []
+
+    def record_lock(self, step):
+        lock = huggingface_logic.registry.get(self.model_name).lock
+        self.lock_held.append((step, lock.locked()))
+
+    def generate(self, input_ids, streamer, max_new_tokens, pad_token_id):
+        self.record_lock("generate")
+        if self.error:
+            raise self.error
+        for word in ("spinning ", "tonight"):
+            streamer.put(word)
+        streamer.end()
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    monkeypatch.setattr(huggingface_logic, "TextIteratorStreamer", FakeStreamer)
+    registry = huggingface_logic.PipelineRegistry(loader=StreamingPipe)
+    monkeypatch.setattr(huggingface_logic, "registry", registry)
+    return registry
+
+
+def test_ask_stream_yields_generated_text(streaming):
+    assert list(huggingface_logic.ask_stream("hi", "m")) == ["spinning ", "tonight"]
+    pipe = streaming.get("m").pipe
+    assert pipe.tokenizer.calls == ["hi"]
+    assert pipe.lock_held == [("tokenize", True), ("generate", True)]
+
+
+def test_ask_stream_raises_generation_errors(streaming):
+    streaming.loader = lambda model: StreamingPipe(model, error=RuntimeError("oom"))
+    with pytest.raises(RuntimeError, match="oom"):
+        list(huggingface_logic.ask_stream("hi", "m"))
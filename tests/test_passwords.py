@@ -0,0 +1,88 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import db
+import migrations
+import passwords
+
+# Cheap parameters keep the tests fast; the format is what matters here.
+FAST = "scrypt:1024:8:1"
+OLD = "pbkdf2:sha256:1000"
+
+
+@pytest.fixture
+def pool():
+    hash_pool = passwords.HashPool(workers=1, method=FAST)
+    yield hash_pool
+    hash_pool.shutdown()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = db.connect(str(tmp_path / "app.db"))
+    migrations.migrate(connection)
+    yield connection
+    connection.close()
+
+
+def test_hash_and_check_in_pool(pool):
+    stored = pool.hash_password("s3cret")
+    method, salt, digest = stored.split("$")
+    assert method == FAST
+    assert len(salt) == passwords.SALT_LENGTH
+    assert pool.check_password(stored, "s3cret")
+    assert not pool.check_password(stored, "wrong")
+    assert pool.hash_password("s3cret") != stored
+
+
+def test_inline_pool_matches_process_pool(pool):
+    inline = passwords.HashPool(workers=0, method=FAST)
+    assert pool.check_password(inline.hash_password("pw"), "pw")
+    assert inline.check_password(pool.hash_password("pw"), "pw")
+
+
+def test_malformed_or_unknown_hash_does_not_verify(pool):
+    assert not pool.check_password("not-a-hash", "pw")
+    assert not pool.check_password("md5$salt$abc", "pw")
+
+
+def test_needs_rehash():
+    assert not passwords.needs_rehash(f"{FAST}$salt$abc", FAST)
+    assert passwords.needs_rehash(f"{OLD}$salt$abc", FAST)
+
+
+def test_short_method_names_do_not_force_rehash(conn):
+    short = "pbkdf2:sha256"
+    stored = passwords.HashPool(workers=0, method=short).hash_password("pw")
+    assert stored.startswith("pbkdf2:sha256:")  # werkzeug adds the iterations
+    assert not passwords.needs_rehash(stored, short)
+    with conn:
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'dj', ?)",
+                     (stored,))
+    pool = passwords.HashPool(workers=0, method=short)
+    assert passwords.authenticate(conn, "dj", "pw", pool=pool) == 1
+    assert conn.execute("SELECT password_hash FROM users").fetchone()[0] == stored
+
+
+def test_authenticate_rehashes_outdated_hash(conn, pool):
+    old = passwords.HashPool(workers=0, method=OLD).hash_password("pw")
+    with conn:
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'dj', ?)",
+                     (old,))
+
+    assert passwords.authenticate(conn, "dj", "wrong", pool=pool) is None
+    stored = conn.execute("SELECT password_hash FROM users").fetchone()[0]
+    assert stored == old
+
+    assert passwords.authenticate(conn, "dj", "pw", pool=pool) == 1
+    stored = conn.execute("SELECT password_hash FROM users").fetchone()[0]
+    assert stored.startswith(FAST + "$")
+    assert passwords.authenticate(conn, "dj", "pw", pool=pool) == 1
+    assert conn.execute("SELECT password_hash FROM users").fetchone()[0] == stored
+
+
+def test_authenticate_unknown_user(conn, pool):
+    assert passwords.authenticate(conn, "nobody", "pw", pool=pool) is None
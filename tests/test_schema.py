@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import db
+import migrations
+
+# Hot queries and the index each one must be answered from.
+HOT_QUERIES = [
+    ("SELECT id, user_id, content, timestamp FROM messages "
+     "WHERE forum_id = ? ORDER BY timestamp", (1,),
+     "idx_messages_forum_timestamp"),
+    ("SELECT id, content FROM messages WHERE forum_id = ? AND timestamp > ? "
+     "ORDER BY timestamp DESC LIMIT 50", (1, "2025-01-01"),
+     "idx_messages_forum_timestamp"),
+    ("DELETE FROM tokens WHERE user_id = ?", (1,), "idx_tokens_user_id"),
+    ("SELECT token FROM tokens WHERE user_id = ?", (1,), "idx_tokens_user_id"),
+    ("SELECT user_id FROM tokens WHERE token = ?", ("t",), "sqlite_autoindex_tokens_1"),
+    ("SELECT id, content FROM messages WHERE user_id = ?", (1,), "idx_messages_user_id"),
+    ("SELECT id, password_hash FROM users WHERE username = ?", ("u",),
+     "sqlite_autoindex_users_1"),
+    ("SELECT id, title, url FROM tracks WHERE id > ? ORDER BY id LIMIT 50", (0,),
+     "INTEGER PRIMARY KEY"),
+    ("SELECT rowid FROM tokens WHERE expires_at <= ? "
+     "OR (expires_at IS NULL AND created_at <= ?) LIMIT 500", (0, "2000-01-01"),
+     "idx_tokens_expires_at"),
+]
+
+
+def query_plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def assert_uses_index(conn, sql, params, index):
+    """Fail unless the query is answered from ``index`` without a full scan
+    or a temporary sort."""
+    plan = query_plan(conn, sql, params)
+    detail = "\n".join(plan)
+    assert any(index in step for step in plan), detail
+    assert not any(step.startswith("SCAN") and "INDEX" not in step
+                   for step in plan), detail
+    assert not any("TEMP B-TREE" in step for step in plan), detail
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = db.connect(str(tmp_path / "app.db"))
+    migrations.migrate(connection)
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize("sql,params,index", HOT_QUERIES)
+def test_hot_query_uses_index(conn, sql, params, index):
+    assert_uses_index(conn, sql, params, index)
+
+
+def test_init_db_migrates_to_latest(tmp_path):
+    path = str(tmp_path / "app.db")
+    env = dict(os.environ, DB_PATH=path)
+    for _ in range(2):
+        subprocess.run([sys.executable, "scripts/init_db.py"], env=env,
+                       check=True, stdout=subprocess.PIPE)
+    connection = db.connect(path)
+    try:
+        assert migrations.current_version(connection) == migrations.LATEST_VERSION
+    finally:
+        connection.close()
+
+
+def test_migrate_adopts_unversioned_database(tmp_path):
+    path = str(tmp_path / "app.db")
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE tracks (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "title TEXT NOT NULL, url TEXT NOT NULL)")
+    legacy.execute("INSERT INTO tracks (title, url) VALUES ('kept', 'http://e.com')")
+    legacy.commit()
+    legacy.close()
+
+    connection = db.connect(path)
+    try:
+        assert migrations.migrate(connection) == migrations.LATEST_VERSION
+        assert connection.execute("SELECT title FROM tracks").fetchone()[0] == "kept"
+    finally:
+        connection.close()
+
+
+def test_migrate_stops_at_target_and_resumes(tmp_path):
+    connection = db.connect(str(tmp_path / "app.db"))
+    try:
+        assert migrations.migrate(connection, target=1) == 1
+        assert "idx_tokens_user_id" not in str(query_plan(
+            connection, "SELECT token FROM tokens WHERE user_id = ?", (1,)))
+        assert migrations.migrate(connection) == migrations.LATEST_VERSION
+    finally:
+        connection.close()
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    def broken(conn):
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS",
+                        migrations.MIGRATIONS + [("broken", broken)])
+    monkeypatch.setattr(migrations, "LATEST_VERSION", len(migrations.MIGRATIONS))
+    connection = db.connect(str(tmp_path / "app.db"))
+    try:
+        with pytest.raises(migrations.MigrationError):
+            migrations.migrate(connection)
+        assert migrations.current_version(connection) == migrations.LATEST_VERSION - 1
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        assert "half_done" not in tables
+    finally:
+        connection.close()
+
+
+def test_migrate_runs_while_reader_is_open(tmp_path):
+    path = str(tmp_path / "app.db")
+    connection = db.connect(path)
+    migrations.migrate(connection, target=1)
+    reader = db.connect(path)
+    try:
+        reader.execute("BEGIN")
+        reader.execute("SELECT COUNT(*) FROM tracks").fetchone()
+        assert migrations.migrate(connection) == migrations.LATEST_VERSION
+        reader.execute("COMMIT")
+    finally:
+        reader.close()
+        connection.close()
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import types
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import answer_cache
+import chat
+import semantic_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(**kwargs):
+    kwargs.setdefault("threshold", 0.55)
+    return semantic_cache.SemanticCache(embedder=semantic_cache.HashingEmbedder(), **kwargs)
+
+
+def test_hashing_embedder_returns_unit_vectors():
+    vectors = semantic_cache.HashingEmbedder(dim=64)(["What music do you play?", ""])
+    assert vectors.shape == (2, 64)
+    assert np.linalg.norm(vectors[0]) == pytest.approx(1.0)
+    assert not vectors[1].any()
+
+
+def test_paraphrase_hits_and_unrelated_question_misses():
+    cache = make_cache()
+    cache.add("When is your next gig?", "Friday at the Melkweg")
+    answer, matched, score = cache.lookup("whens ur next gig")
+    assert answer == "Friday at the Melkweg"
+    assert matched == "When is your next gig?"
+    assert 0.55 <= score <= 1
+    assert cache.lookup("How much does a booking cost?") is None
+    assert (cache.stats["hits"], cache.stats["misses"]) == (1, 1)
+
+
+def test_entries_only_match_their_scope():
+    cache = make_cache()
+    cache.add("What music do you play?", "Techno", scope="openai")
+    assert cache.lookup("What music do you play?", scope="gemini") is None
+    assert cache.lookup("What music do you play?", scope="openai")[0] == "Techno"
+
+
+def test_expired_entries_do_not_match():
+    clock = FakeClock()
+    cache = make_cache(ttl=60, clock=clock)
+    cache.add("What music do you play?", "Techno")
+    clock.now += 61
+    assert cache.lookup("What music do you play?") is None
+
+
+def test_full_index_evicts_expired_then_least_recently_used():
+    clock = FakeClock()
+    cache = make_cache(max_entries=2, ttl=100, clock=clock)
+    cache.add("When is your next gig?", "Friday")
+    clock.now += 1
+    cache.add("Do you play techno?", "Yes")
+    clock.now += 1
+    cache.lookup("When is your next gig?")
+    clock.now += 1
+    cache.add("How do I book you?", "Use the form")
+    assert len(cache) == 2
+    assert cache.lookup("Do you play techno?") is None
+    assert cache.lookup("When is your next gig?")[0] == "Friday"
+    assert cache.stats["evictions"] == 1
+
+    clock.now += 99  # "When is your next gig?" expires first
+    cache.add("Do you play hardstyle?", "Sometimes")
+    assert cache.lookup("How do I book you?")[0] == "Use the form"
+    assert cache.top() == [("How do I book you?", 1), ("Do you play hardstyle?", 0)]
+
+
+def test_evaluate_reports_hit_rate_and_precision():
+    questions = ["When is your next gig?", "whens ur next gig", "Do you play techno?"]
+    intents = ["gig", "gig", "techno"]
+    strict, loose = semantic_cache.evaluate(
+        questions, intents, [0.99, 0.0], semantic_cache.HashingEmbedder())
+    assert (strict["hits"], strict["hit_rate"]) == (0, 0.0)
+    assert loose["hits"] == 2
+    assert loose["wrong"] == 1
+    assert loose["precision"] == 0.5
+
+
+def test_chat_uses_semantic_cache_for_paraphrases(monkeypatch):
+    calls = []
+
+    def ask(question):
+        calls.append(question)
+        return {"text": "Friday at the Melkweg"}
+
+    monkeypatch.setattr(chat, "BACKENDS", {"dj": types.SimpleNamespace(ask=ask)})
+    exact = answer_cache.AnswerCache(persist=False)
+    semantic = make_cache()
+    assert chat.ask("When is your next gig?", "dj", exact, semantic)["text"] == \
+        "Friday at the Melkweg"
+    assert chat.ask("whens ur next gig", "dj", exact, semantic)["text"] == \
+        "Friday at the Melkweg"
+    assert calls == ["When is your next gig?"]
+    # The paraphrase is now in the exact cache too
+    assert semantic.stats["hits"] == 1
+    chat.ask("whens ur next gig", "dj", exact, semantic)
+    assert semantic.stats["hits"] == 1
+
+
+def test_chat_survives_semantic_cache_errors(monkeypatch):
+    def broken(texts):
+        raise RuntimeError("model download failed")
+
+    monkeypatch.setattr(chat, "BACKENDS", {
+        "dj": types.SimpleNamespace(ask=lambda question: {"text": "hi"})})
+    semantic = semantic_cache.SemanticCache(embedder=broken)
+    semantic._vectors = np.zeros((semantic.max_entries, 4), dtype=np.float32)
+    exact = answer_cache.AnswerCache(persist=False)
+    assert chat.ask("q", "dj", exact, semantic) == {"text": "hi"}
@@ -0,0 +1,371 @@
+import functools
+import gzip
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+
+import server
+import hash_assets
+import precompress_assets
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(port, **extra_env):
+    env = os.environ.copy()
+    env["PORT"] = str(port)
+    env.update(extra_env)
+    proc = subprocess.Popen(["python", "server.py"], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    time.sleep(2)
+    return proc
+
+
+@pytest.fixture
+def site(tmp_path):
+    """Serve tmp_path in-process and yield (root, base_url)."""
+    handler = functools.partial(server.KeepAliveHTTPRequestHandler,
+                                directory=str(tmp_path))
+    httpd = server.PooledHTTPServer(("127.0.0.1", 0), handler, workers=8)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield tmp_path, f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_keep_alive_reuses_connection():
+    port = get_free_port()
+    proc = start_server(port)
+    conn = http.client.HTTPConnection("localhost", port, timeout=5)
+    try:
+        conn.request("GET", "/index.html")
+        first = conn.getresponse()
+        first.read()
+        sock = conn.sock
+        conn.request("GET", "/assets/css/style.css")
+        second = conn.getresponse()
+        second.read()
+        assert (first.status, second.status) == (200, 200)
+        assert first.version == 11
+        assert second.getheader("Connection", "").lower() != "close"
+        # http.client reconnects transparently, so check the socket itself
+        assert sock is not None and conn.sock is sock
+    finally:
+        conn.close()
+        proc.terminate()
+        proc.wait(timeout=5)
+
+
+def test_idle_connections_do_not_block_other_clients():
+    port = get_free_port()
+    workers = 4
+    proc = start_server(port, SERVER_WORKERS=str(workers))
+    idle = []
+    try:
+        # As many idle keep-alive connections as there are workers, as a
+        # couple of browsers leave behind after loading a page...
+        for _ in range(workers):
+            conn = http.client.HTTPConnection("localhost", port, timeout=5)
+            conn.request("GET", "/index.html")
+            conn.getresponse().read()
+            idle.append(conn)
+        # ...and a client that connects but never finishes its request
+        stalled = socket.create_connection(("localhost", port))
+        stalled.sendall(b"GET /index.html HTTP/1.1\r\n")
+        results = []
+
+        def fetch():
+            res = requests.get(f"http://localhost:{port}/index.html", timeout=5)
+            results.append(res.status_code)
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=fetch) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [200, 200, 200]
+        assert time.monotonic() - started < 2
+        stalled.close()
+    finally:
+        for conn in idle:
+            conn.close()
+        proc.terminate()
+        proc.wait(timeout=5)
+
+
+def test_slow_downloads_do_not_block_other_clients(tmp_path):
+    workers = 2
+    (tmp_path / "track.mp3").write_bytes(b"\0" * (32 * 1024 * 1024))
+    (tmp_path / "index.html").write_text("<h1>hi</h1>")
+    handler = functools.partial(server.KeepAliveHTTPRequestHandler,
+                                directory=str(tmp_path))
+    httpd = server.PooledHTTPServer(("127.0.0.1", 0), handler, workers=workers)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+    readers = []
+    try:
+        # Listeners who start a track and then stop reading it
+        for _ in range(workers):
+            reader = socket.create_connection(("127.0.0.1", port))
+            reader.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            reader.sendall(b"GET /track.mp3 HTTP/1.1\r\nHost: x\r\n\r\n")
+            reader.recv(1024)
+            readers.append(reader)
+        time.sleep(0.2)
+        res = requests.get(f"http://127.0.0.1:{port}/index.html", timeout=2)
+        assert res.status_code == 200
+    finally:
+        for reader in readers:
+            reader.close()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_range_request_returns_partial_content():
+    port = get_free_port()
+    proc = start_server(port)
+    url = f"http://localhost:{port}/assets/css/style.css"
+    try:
+        full = requests.get(url)
+        assert full.headers["Accept-Ranges"] == "bytes"
+        size = len(full.content)
+
+        res = requests.get(url, headers={"Range": "bytes=10-19"})
+        assert res.status_code == 206
+        assert res.headers["Content-Range"] == f"bytes 10-19/{size}"
+        assert res.content == full.content[10:20]
+
+        tail = requests.get(url, headers={"Range": "bytes=-5"})
+        assert tail.status_code == 206
+        assert tail.content == full.content[-5:]
+
+        past_end = requests.get(url, headers={"Range": f"bytes={size}-"})
+        assert past_end.status_code == 416
+        assert past_end.headers["Content-Range"] == f"bytes */{size}"
+    finally:
+        proc.terminate()
+        proc.wait(timeout=5)
+
+
+def test_multi_range_and_stale_if_range_send_whole_file():
+    port = get_free_port()
+    proc = start_server(port)
+    url = f"http://localhost:{port}/assets/css/style.css"
+    try:
+        full = requests.get(url)
+        multi = requests.get(url, headers={"Range": "bytes=0-1,5-6"})
+        assert multi.status_code == 200
+        assert multi.content == full.content
+
+        stale = requests.get(url, headers={
+            "Range": "bytes=0-9",
+            "If-Range": "Thu, 01 Jan 1970 00:00:00 GMT",
+        })
+        assert stale.status_code == 200
+        assert stale.content == full.content
+
+        fresh = requests.get(url, headers={
+            "Range": "bytes=0-9",
+            "If-Range": full.headers["Last-Modified"],
+        })
+        assert fresh.status_code == 206
+    finally:
+        proc.terminate()
+        proc.wait(timeout=5)
+
+
+def test_precompressed_sidecar_is_negotiated(site):
+    root, base = site
+    (root / "app.js").write_text("console.log('x');" * 100)
+    (root / "app.js.gz").write_bytes(gzip.compress((root / "app.js").read_bytes()))
+
+    res = requests.get(f"{base}/app.js", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert res.headers["Vary"] == "Accept-Encoding"
+    assert res.headers["Content-Type"].endswith("javascript")
+    assert res.text == (root / "app.js").read_text()
+
+    plain = requests.get(f"{base}/app.js", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Vary"] == "Accept-Encoding"
+
+    refused = requests.get(f"{base}/app.js", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in refused.headers
+
+
+def test_stale_sidecar_is_ignored(site):
+    root, base = site
+    (root / "style.css").write_text("body { color: red; }")
+    (root / "style.css.gz").write_bytes(gzip.compress(b"old"))
+    os.utime(root / "style.css.gz", (0, 0))
+
+    res = requests.get(f"{base}/style.css", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in res.headers
+    assert res.text == "body { color: red; }"
+
+
+def test_precompress_only_rewrites_changed_files(tmp_path):
+    (tmp_path / "a.js").write_text("a" * 500)
+    (tmp_path / "b.css").write_text("b" * 500)
+    config = tmp_path / "bundle.config.json"
+    config.write_text(json.dumps({"entry": {"main": ["a.js"]},
+                                  "css": {"main": ["b.css"]}}))
+
+    assert precompress_assets.precompress(tmp_path, config) == ["a.js", "b.css"]
+    assert gzip.decompress((tmp_path / "a.js.gz").read_bytes()) == b"a" * 500
+    assert precompress_assets.precompress(tmp_path, config) == []
+
+    # Touched but unchanged (git checkout, rsync): the sidecar is brought
+    # up to date so the server keeps using it
+    source = tmp_path / "a.js"
+    later = source.stat().st_mtime_ns + 5 * 10**9
+    os.utime(source, ns=(later, later))
+    assert precompress_assets.precompress(tmp_path, config) == []
+    assert (tmp_path / "a.js.gz").stat().st_mtime_ns >= later
+
+    (tmp_path / "b.css").write_text("c" * 500)
+    assert precompress_assets.precompress(tmp_path, config) == ["b.css"]
+
+
+def test_etag_revalidation_returns_304(site):
+    root, base = site
+    (root / "main.js").write_text("let a = 1;")
+
+    first = requests.get(f"{base}/main.js")
+    etag = first.headers["ETag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+
+    again = requests.get(f"{base}/main.js", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+    weak = requests.get(f"{base}/main.js", headers={"If-None-Match": f"W/{etag}"})
+    assert weak.status_code == 304
+
+    (root / "main.js").write_text("let a = 2;")
+    changed = requests.get(f"{base}/main.js", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_if_range_accepts_matching_etag(site):
+    root, base = site
+    (root / "track.mp3").write_bytes(bytes(range(256)) * 4)
+    etag = requests.head(f"{base}/track.mp3").headers["ETag"]
+
+    res = requests.get(f"{base}/track.mp3",
+                       headers={"Range": "bytes=0-3", "If-Range": etag})
+    assert res.status_code == 206
+    assert res.content == bytes(range(4))
+
+
+def test_etag_cache_is_bounded_and_checks_mtime(tmp_path):
+    cache = server.ETagCache(max_entries=2)
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / name
+        path.write_text(name)
+        paths.append(str(path))
+        cache.get(str(path), os.stat(path))
+    assert len(cache) == 2
+
+    before = cache.get(paths[2], os.stat(paths[2]))
+    with open(paths[2], "w") as f:
+        f.write("changed")
+    assert cache.get(paths[2], os.stat(paths[2])) != before
+
+
+def test_response_cache_hits_and_invalidates(site, monkeypatch):
+    root, base = site
+    cache = server.ResponseCache(max_bytes=1024, max_file_size=512)
+    monkeypatch.setattr(server, "RESPONSE_CACHE", cache)
+    (root / "index.html").write_text("<p>one</p>")
+
+    first = requests.get(f"{base}/index.html")
+    second = requests.get(f"{base}/index.html")
+    assert second.text == first.text == "<p>one</p>"
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert second.headers["Content-Type"] == "text/html"
+    assert second.headers["X-Frame-Options"] == "DENY"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+    (root / "index.html").write_text("<p>two!</p>")
+    assert requests.get(f"{base}/index.html").text == "<p>two!</p>"
+    assert cache.stats()["misses"] == 2
+
+    (root / "big.js").write_text("x" * 600)
+    assert requests.get(f"{base}/big.js").text == "x" * 600
+    assert cache.stats()["entries"] == 1
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = server.ResponseCache(max_bytes=10, max_file_size=10)
+    for name in ("a", "b", "c"):
+        path = tmp_path / name
+        path.write_text(name * 4)
+        entry = server.CachedResponse((4, 0), path.read_bytes(), '"x"', 0, b"")
+        cache.put(str(path), entry)
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 8
+    assert stats["evictions"] == 1
+
+
+def test_hashed_assets_are_immutable(site):
+    root, base = site
+    (root / "main.0123abcd.js").write_text("let a = 1;")
+    (root / "main.js").write_text("let a = 1;")
+
+    hashed = requests.get(f"{base}/main.0123abcd.js")
+    assert hashed.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    plain = requests.get(f"{base}/main.js")
+    assert "Cache-Control" not in plain.headers
+
+
+def test_hash_assets_rewrites_pages_idempotently(tmp_path):
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "main.js").write_text("let a = 1;")
+    (tmp_path / "index.html").write_text(
+        '<script src="assets/main.js"></script><link href="/assets/main.js?v=1">')
+    config = tmp_path / "bundle.config.json"
+    config.write_text(json.dumps({"entry": {"main": ["assets/main.js"]}}))
+
+    manifest, rewritten = hash_assets.build(tmp_path, config)
+    first = manifest["assets/main.js"]
+    assert first != "assets/main.js"
+    assert (tmp_path / first).read_text() == "let a = 1;"
+    assert rewritten == ["index.html"]
+    html = (tmp_path / "index.html").read_text()
+    assert html == (f'<script src="{first}"></script>'
+                    f'<link href="/{first}?v=1">')
+
+    (tmp_path / "assets" / "main.js").write_text("let a = 2;")
+    manifest, _ = hash_assets.build(tmp_path, config)
+    second = manifest["assets/main.js"]
+    assert second != first
+    assert not (tmp_path / first).exists()
+    assert (tmp_path / "index.html").read_text().count(second) == 2
+
+    # Hashed copies get precompressed too
+    assert second in precompress_assets.precompress(tmp_path, config)
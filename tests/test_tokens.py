@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import db
+import migrations
+import tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = db.connect(str(tmp_path / "app.db"))
+    migrations.migrate(connection)
+    with connection:
+        connection.execute("INSERT INTO users (id, username, password_hash, is_premium) "
+                           "VALUES (1, 'dj', 'x', 1), (2, 'fan', 'x', 0)")
+        connection.executemany("INSERT INTO tokens (token, user_id) VALUES (?, ?)",
+                               [("a", 1), ("b", 1), ("c", 2)])
+    yield connection
+    connection.close()
+
+
+def test_resolve_caches_until_ttl(conn):
+    clock = FakeClock()
+    cache = tokens.TokenCache(ttl=10, check_interval=100, clock=clock)
+    assert cache.resolve(conn, "a") == (1, True)
+    assert cache.resolve(conn, "a") == (1, True)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    clock.now += 11
+    cache.resolve(conn, "a")
+    assert cache.misses == 2
+
+
+def test_unknown_tokens_are_not_cached(conn):
+    cache = tokens.TokenCache()
+    assert cache.resolve(conn, "new") is None
+    with conn:
+        conn.execute("INSERT INTO tokens (token, user_id) VALUES ('new', 2)")
+    assert cache.resolve(conn, "new") == (2, False)
+
+
+def test_revoke_invalidates_locally(conn):
+    cache = tokens.TokenCache(check_interval=100)
+    cache.resolve(conn, "a")
+    cache.resolve(conn, "b")
+    cache.resolve(conn, "c")
+    tokens.revoke_token(conn, "c", cache=cache)
+    assert cache.resolve(conn, "c") is None
+    tokens.revoke_user_tokens(conn, 1, cache=cache)
+    assert cache.resolve(conn, "a") is None
+    assert cache.resolve(conn, "b") is None
+
+
+def test_change_counter_invalidates_other_workers(conn, tmp_path):
+    clock = FakeClock()
+    cache = tokens.TokenCache(ttl=600, check_interval=1, clock=clock)
+    assert cache.resolve(conn, "a") == (1, True)
+
+    # Another worker revokes through its own connection and cache
+    other = db.connect(str(tmp_path / "app.db"))
+    tokens.revoke_token(other, "a", cache=tokens.TokenCache())
+    other.close()
+
+    assert cache.resolve(conn, "a") == (1, True)  # within the check interval
+    clock.now += 2
+    assert cache.resolve(conn, "a") is None
+
+
+def test_premium_change_invalidates(conn):
+    clock = FakeClock()
+    cache = tokens.TokenCache(ttl=600, check_interval=0, clock=clock)
+    assert cache.resolve(conn, "c") == (2, False)
+    with conn:
+        conn.execute("UPDATE users SET is_premium = 1 WHERE id = 2")
+    assert cache.resolve(conn, "c") == (2, True)
+
+
+def test_slide_and_sweep_keep_other_cached_tokens(conn):
+    now = int(time.time())
+    with conn:
+        conn.execute("UPDATE tokens SET expires_at = ? WHERE token = 'b'", (now + 60,))
+        conn.execute("INSERT INTO tokens (token, user_id, expires_at) VALUES ('old', 2, ?)",
+                     (now - 1,))
+    cache = tokens.TokenCache(ttl=600, check_interval=0)
+    cache.resolve(conn, "a")
+    cache.resolve(conn, "c")
+    version = tokens.change_counter(conn)
+
+    assert cache.resolve(conn, "b") == (1, True)  # due for a refresh: slides
+    assert tokens.sweep_expired(conn, pause=0) == 1
+    assert tokens.change_counter(conn) == version
+    assert len(cache) == 3
+    cache.resolve(conn, "a")
+    cache.resolve(conn, "c")
+    assert cache.hits == 2
+
+
+def test_cache_is_bounded(conn):
+    cache = tokens.TokenCache(max_entries=2)
+    for token in ("a", "b", "c"):
+        cache.resolve(conn, token)
+    assert len(cache) == 2
+
+
+def test_issued_token_expires_after_ttl(conn):
+    now = int(time.time())
+    token = tokens.issue_token(conn, 2, now=now)
+    assert tokens.lookup_token(conn, token, now=now) == (2, False)
+    assert tokens.lookup_token(conn, token, now=now + int(tokens.TOKEN_TTL)) is None
+
+
+def test_use_slides_expiry_at_most_once_per_interval(conn):
+    now = int(time.time())
+    token = tokens.issue_token(conn, 1, now=now)
+
+    def expiry():
+        return conn.execute("SELECT expires_at FROM tokens WHERE token = ?",
+                            (token,)).fetchone()[0]
+
+    tokens.lookup_token(conn, token, now=now + 60)
+    assert expiry() == now + int(tokens.TOKEN_TTL)
+
+    later = now + int(tokens.TOKEN_REFRESH_INTERVAL) + 1
+    tokens.lookup_token(conn, token, now=later)
+    assert expiry() == later + int(tokens.TOKEN_TTL)
+
+
+def test_max_age_caps_sliding(conn, monkeypatch):
+    monkeypatch.setattr(tokens, "TOKEN_MAX_AGE", 3600)
+    created = conn.execute("SELECT CAST(strftime('%s', created_at) AS INTEGER) "
+                           "FROM tokens WHERE token = 'a'").fetchone()[0]
+    assert tokens.lookup_token(conn, "a", now=created + 10) == (1, True)
+    assert tokens.lookup_token(conn, "a", now=created + 3600) is None
+
+
+def test_sweep_deletes_expired_in_batches(conn):
+    now = int(time.time())
+    with conn:
+        conn.executemany(
+            "INSERT INTO tokens (token, user_id, expires_at) VALUES (?, 1, ?)",
+            [(f"old{i}", now - 1) for i in range(25)] + [("fresh", now + 100)])
+        conn.execute("INSERT INTO tokens (token, user_id, created_at) "
+                     "VALUES ('legacy', 2, '2000-01-01 00:00:00')")
+    assert tokens.token_table_stats(conn, now=now)["expired_pending"] == 25
+
+    assert tokens.sweep_expired(conn, now=now, batch_size=10, pause=0) == 26
+    remaining = {row[0] for row in conn.execute("SELECT token FROM tokens")}
+    assert remaining == {"a", "b", "c", "fresh"}
+
+
+def test_sweeper_thread_records_stats(tmp_path, conn):
+    with conn:
+        conn.execute("INSERT INTO tokens (token, user_id, expires_at) VALUES ('x', 1, 1)")
+    sweeper = tokens.TokenSweeper(str(tmp_path / "app.db"), interval=60)
+    sweeper.start()
+    try:
+        deadline = time.time() + 5
+        while sweeper.stats["last_sweep_at"] is None and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sweeper.stop()
+        sweeper.join(timeout=5)
+    assert sweeper.stats["deleted_total"] == 1
+    assert sweeper.stats["tokens"] == 3
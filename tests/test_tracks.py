@@ -0,0 +1,152 @@
+import io
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import db
+import migrations
+import tracks
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = db.connect(str(tmp_path / "app.db"))
+    migrations.migrate(connection)
+    yield connection
+    connection.close()
+
+
+def add_tracks(conn, count):
+    conn.executemany("INSERT INTO tracks (title, url) VALUES (?, ?)",
+                     [(f"t{i}", f"http://e.com/{i}") for i in range(count)])
+    conn.commit()
+
+
+def test_keyset_pages_cover_every_track_once(conn):
+    add_tracks(conn, 7)
+    seen = []
+    after = 0
+    while True:
+        page, after = tracks.list_tracks(conn, after=after, limit=3)
+        seen += [track["id"] for track in page]
+        if after is None:
+            break
+    assert seen == list(range(1, 8))
+
+
+def test_last_page_has_no_cursor(conn):
+    add_tracks(conn, 3)
+    page, cursor = tracks.list_tracks(conn, limit=3)
+    assert len(page) == 3
+    assert cursor is None
+    assert page[0] == {"id": 1, "title": "t0", "url": "http://e.com/0"}
+
+
+def test_parse_page_args():
+    assert tracks.parse_page_args({}) == (0, tracks.DEFAULT_PAGE_SIZE)
+    assert tracks.parse_page_args({"after": "10", "limit": "5000"}) == (
+        10, tracks.MAX_PAGE_SIZE)
+    with pytest.raises(ValueError):
+        tracks.parse_page_args({"limit": "0"})
+    with pytest.raises(ValueError):
+        tracks.parse_page_args({"after": "abc"})
+
+
+def test_etag_changes_only_when_tracks_change(conn):
+    empty = tracks.tracks_etag(conn)
+    add_tracks(conn, 1)
+    added = tracks.tracks_etag(conn)
+    assert added != empty
+    tracks.list_tracks(conn)
+    assert tracks.tracks_etag(conn) == added
+
+    conn.execute("UPDATE tracks SET title = 'renamed' WHERE id = 1")
+    conn.commit()
+    renamed = tracks.tracks_etag(conn)
+    assert renamed != added
+
+    conn.execute("DELETE FROM tracks WHERE id = 1")
+    conn.commit()
+    assert tracks.tracks_etag(conn) not in (empty, added, renamed)
+
+
+def test_search_folds_diacritics_and_matches_prefixes(conn):
+    conn.executemany("INSERT INTO tracks (title, url) VALUES (?, ?)", [
+        ("Tiësto & Mathame - Everlight", "http://e.com/1"),
+        ("KREAM - Arrival", "http://e.com/2"),
+        ("Bedouin - Petra (TWO LANES Remix)", "http://e.com/3"),
+    ])
+    conn.commit()
+
+    assert [t["id"] for t in tracks.search_tracks(conn, "tiesto")] == [1]
+    assert [t["id"] for t in tracks.search_tracks(conn, "Tiësto")] == [1]
+    assert [t["id"] for t in tracks.search_tracks(conn, "arr")] == [2]
+    assert [t["id"] for t in tracks.search_tracks(conn, "petra remix")] == [3]
+    assert tracks.search_tracks(conn, "nothing") == []
+
+
+def test_search_highlights_and_escapes(conn):
+    conn.execute("INSERT INTO tracks (title, url) VALUES (?, ?)",
+                 ("<b>Rolling</b> Stones", "http://e.com/1"))
+    conn.commit()
+    result = tracks.search_tracks(conn, "roll")[0]
+    assert result["highlight"] == "&lt;b&gt;<mark>Rolling</mark>&lt;/b&gt; Stones"
+
+
+def test_search_ranks_and_ignores_fts_syntax(conn):
+    conn.executemany("INSERT INTO tracks (title, url) VALUES (?, ?)", [
+        ("Move Your Body (Extended Mix) - long title with many other words", "u"),
+        ("Move Your Body", "u"),
+    ])
+    conn.commit()
+    assert tracks.search_tracks(conn, "move body")[0]["title"] == "Move Your Body"
+    assert len(tracks.search_tracks(conn, 'body" title:*')) == 1
+    assert tracks.search_tracks(conn, '"*()') == []
+
+
+def test_search_index_follows_updates_and_deletes(conn):
+    add_tracks(conn, 2)
+    conn.execute("UPDATE tracks SET title = 'Good Life' WHERE id = 1")
+    conn.execute("DELETE FROM tracks WHERE id = 2")
+    conn.commit()
+    assert [t["id"] for t in tracks.search_tracks(conn, "good")] == [1]
+    assert tracks.search_tracks(conn, "t0") == []
+    assert tracks.search_tracks(conn, "t1") == []
+
+
+def test_bulk_import_reports_bad_rows_without_aborting(conn):
+    body = io.StringIO("\n".join([
+        json.dumps({"title": "One", "url": "http://e.com/1"}),
+        "{not json",
+        json.dumps({"title": "a" * 201, "url": "http://e.com/2"}),
+        "",
+        json.dumps({"title": "Two", "url": "http://e.com/" + "a" * 501}),
+        json.dumps({"title": "Three", "url": "http://e.com/3"}),
+    ]))
+    result = tracks.import_tracks(conn, tracks.iter_records(body), chunk_size=1)
+    assert result["inserted"] == 2
+    assert result["failed"] == 3
+    assert [error["row"] for error in result["errors"]] == [2, 3, 4]
+    titles = [row[0] for row in conn.execute("SELECT title FROM tracks ORDER BY id")]
+    assert titles == ["One", "Three"]
+
+
+def test_bulk_import_streams_json_array(conn):
+    records = [{"title": f"t{i}", "url": f"http://e.com/{i}"} for i in range(1200)]
+    records[5] = {"title": "", "url": "http://e.com"}
+    body = io.StringIO("  " + json.dumps(records, indent=1))
+    parsed = tracks.iter_json_array(body, chunk_size=7)
+    result = tracks.import_tracks(conn, parsed, chunk_size=500)
+    assert result["inserted"] == 1199
+    assert result["errors"] == [{"row": 6, "error": "Title is required"}]
+    assert conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0] == 1199
+
+
+def test_truncated_json_array_keeps_rows_before_the_error(conn):
+    body = io.StringIO('[{"title": "ok", "url": "u"}, {"title": "bro')
+    result = tracks.import_tracks(conn, tracks.iter_records(body))
+    assert result["inserted"] == 1
+    assert result["errors"][0]["row"] == 2
@@ -1,10 +1,15 @@
+import http.server
+import json
 import requests
 import os
 import sys
+import threading
+import time
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 import requests_mock
 import pytest
 
+import worker_logic
 from worker_logic import ask, SYSTEM_PROMPT
 
 
@@ -56,3 +61,109 @@ def test_worker_ask_timeout():
         with pytest.raises(requests.exceptions.Timeout):
             ask("Hi", "sk-test")
 
+
+class ScriptedHandler(http.server.BaseHTTPRequestHandler):
+    """Answers POSTs with the next (status, headers) from server.script."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append((time.monotonic(), self.client_address[1]))
+        time.sleep(self.server.delay)
+        status, headers = self.server.script.pop(0) if self.server.script else (200, {})
+        body = b'{"id": "ok"}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    server.script = []
+    server.requests = []
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def test_session_reuses_connections(upstream):
+    session = worker_logic.make_session()
+    for _ in range(3):
+        assert session.post(url(upstream), json={}, timeout=5).status_code == 200
+    assert len({port for _, port in upstream.requests}) == 1
+
+
+def test_session_retries_429_honoring_retry_after(upstream):
+    upstream.script = [(429, {"Retry-After": "1"}), (200, {})]
+    response = worker_logic.make_session().post(url(upstream), json={}, timeout=5)
+    assert response.status_code == 200
+    (first, _), (second, _) = upstream.requests
+    assert second - first >= 0.9
+
+
+def test_retry_after_is_capped(upstream, monkeypatch):
+    monkeypatch.setattr(worker_logic.CappedRetry, "max_retry_after", 0.2)
+    upstream.script = [(503, {"Retry-After": "120"}), (200, {})]
+    started = time.monotonic()
+    response = worker_logic.make_session().post(url(upstream), json={}, timeout=5)
+    assert response.status_code == 200
+    assert time.monotonic() - started < 5
+
+
+def test_exhausted_retries_return_the_error_response(upstream):
+    upstream.script = [(503, {"Retry-After": "0"})] * 3
+    session = worker_logic.make_session(max_retries=2)
+    response = session.post(url(upstream), json={}, timeout=5)
+    assert response.status_code == 503
+    assert len(upstream.requests) == 3
+    with pytest.raises(requests.exceptions.HTTPError):
+        response.raise_for_status()
+
+
+def test_slow_upstream_raises_timeout_without_retrying(upstream, monkeypatch):
+    monkeypatch.setattr(worker_logic, "OPENAI_URL", url(upstream))
+    monkeypatch.setattr(worker_logic, "OPENAI_TIMEOUT", 0.2)
+    upstream.delay = 1
+    with pytest.raises(requests.exceptions.Timeout):
+        worker_logic.ask("Hi", "sk-test")
+    assert len(upstream.requests) == 1
+
+
+def test_ask_uses_shared_session():
+    assert worker_logic.get_session() is worker_logic.get_session()
+
+
+def test_worker_ask_stream():
+    chunks = [{"choices": [{"delta": {"role": "assistant"}}]},
+              {"choices": [{"delta": {"content": "Tech"}}]},
+              {"choices": [{"delta": {"content": "nö"}}]}]
+    body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+    with requests_mock.Mocker() as m:
+        m.post("https://api.openai.com/v1/chat/completions",
+               content=body.encode("utf-8"),
+               headers={"Content-Type": "text/event-stream"})
+        assert list(worker_logic.ask_stream("Hi", "sk-test")) == ["Tech", "nö"]
+        assert m.request_history[0].json()["stream"] is True
+
+
+def test_worker_ask_stream_error():
+    with requests_mock.Mocker() as m:
+        m.post("https://api.openai.com/v1/chat/completions", status_code=429)
+        with pytest.raises(requests.exceptions.HTTPError):
+            list(worker_logic.ask_stream("Hi", "sk-test"))
@@ -0,0 +1,405 @@
+import os
+import sys
+import threading
+import time
+import pytest
+import requests
+import requests_mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import db
+import migrations
+import youtube
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFetch:
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    def __call__(self, channel_id):
+        self.calls.append(channel_id)
+        if self.error:
+            raise self.error
+        return {"channel_id": channel_id, "videos": [{"id": f"v{len(self.calls)}"}]}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "app.db")
+    connection = db.connect(path)
+    migrations.migrate(connection)
+    connection.close()
+    yield path
+    db.get_pool(path).close()
+
+
+def make_cache(path, fetch, clock, **kwargs):
+    return youtube.YouTubeCache(path=path, fetch=fetch, fresh_ttl=60,
+                                stale_ttl=600, clock=clock, **kwargs)
+
+
+def test_get_latest_videos_parses_search_results():
+    with requests_mock.Mocker() as m:
+        m.get(youtube.YOUTUBE_SEARCH_URL, json={"items": [
+            {"id": {"videoId": "abc"}, "snippet": {"title": "Live set"}},
+            {"id": {"kind": "youtube#channel"}, "snippet": {"title": "skip"}},
+        ]})
+        result = youtube.get_latest_videos("cid", api_key="key")
+        request = m.request_history[0]
+    assert result["channel_id"] == "cid"
+    assert [video["id"] for video in result["videos"]] == ["abc"]
+    assert result["videos"][0]["title"] == "Live set"
+    assert request.qs["channelid"] == ["cid"]
+    assert request.headers["X-Goog-Api-Key"] == "key"
+    assert "key" not in request.qs and "key" not in request.url.split("?", 1)[1]
+
+
+def test_fresh_entries_are_served_from_memory(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    cache = make_cache(path, fetch, clock)
+    first = cache.get("cid")
+    clock.now += 30
+    assert cache.get("cid") == first
+    assert fetch.calls == ["cid"]
+    assert (cache.stats["misses"], cache.stats["hits"]) == (1, 1)
+
+
+def test_entries_survive_a_restart(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    payload = make_cache(path, fetch, clock).get("cid")
+    restarted = make_cache(path, fetch, clock)
+    assert restarted.get("cid") == payload
+    assert fetch.calls == ["cid"]
+    assert restarted.stats["hits"] == 1
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(path):
+    release = threading.Event()
+    fetch, clock = FakeFetch(), FakeClock()
+    cache = make_cache(path, fetch, clock)
+    cache.get("cid")
+    clock.now += 120
+
+    def slow_fetch(channel_id):
+        release.wait(5)
+        return fetch(channel_id)
+
+    cache.fetch = slow_fetch
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+    release.set()
+    cache.wait_for_refreshes(5)
+
+    assert fetch.calls == ["cid", "cid"]
+    assert cache.stats["stale"] == 2
+    assert cache.stats["refreshes"] == 1
+    assert cache.get("cid")["videos"] == [{"id": "v2"}]
+
+
+def test_failed_refresh_keeps_the_stale_entry(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    cache = make_cache(path, fetch, clock)
+    cache.get("cid")
+    clock.now += 120
+    fetch.error = RuntimeError("quota exceeded")
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+    cache.wait_for_refreshes(5)
+    assert cache.stats["refresh_errors"] == 1
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+
+
+def test_expired_entries_and_misses_fetch_synchronously(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    cache = make_cache(path, fetch, clock)
+    cache.get("cid")
+    clock.now += 1000
+    assert cache.get("cid")["videos"] == [{"id": "v2"}]
+    fetch.error = RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        cache.get("other")
+
+
+def test_stale_entry_is_reread_from_the_table(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    worker_a = make_cache(path, fetch, clock)
+    worker_b = make_cache(path, fetch, clock)
+    worker_a.get("cid")
+    worker_b.get("cid")
+    clock.now += 120
+
+    # Worker B refreshes the stale channel; worker A picks its copy up
+    # from the shared table instead of refreshing again.
+    worker_b.get("cid")
+    worker_b.wait_for_refreshes(5)
+    refreshed = worker_b.get("cid")
+    assert worker_a.get("cid") == refreshed
+    worker_a.wait_for_refreshes(5)
+    assert len(fetch.calls) == 2
+    assert worker_a.stats["refreshes"] == 0
+
+
+def test_memory_tier_is_bounded(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    cache = make_cache(path, fetch, clock, max_entries=2)
+    for channel_id in ("a", "b", "c"):
+        cache.get(channel_id)
+    assert list(cache._entries) == ["b", "c"]
+    # Evicted from memory, still in the table
+    cache.get("a")
+    assert fetch.calls == ["a", "b", "c"]
+
+
+class BlockingFetch(FakeFetch):
+    """Holds every call until released, like a slow upstream."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, channel_id):
+        self.started.set()
+        self.release.wait(5)
+        return super().__call__(channel_id)
+
+
+def run_concurrently(fn, count):
+    results, errors = [], []
+
+    def target():
+        try:
+            results.append(fn())
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_misses_share_one_upstream_call(path):
+    fetch = BlockingFetch()
+    cache = youtube.YouTubeCache(path=path, fetch=fetch)
+    threads, results, errors = run_concurrently(lambda: cache.get("cid"), 5)
+    assert fetch.started.wait(5)
+    time.sleep(0.1)
+    fetch.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert fetch.calls == ["cid"]
+    assert not errors
+    assert len(results) == 5 and all(result == results[0] for result in results)
+    assert cache.stats["coalesced"] == 4
+
+
+def test_concurrent_waiters_share_the_error(path):
+    fetch = BlockingFetch()
+    fetch.error = RuntimeError("quota exceeded")
+    cache = youtube.YouTubeCache(path=path, fetch=fetch)
+    threads, results, errors = run_concurrently(lambda: cache.get("cid"), 3)
+    assert fetch.started.wait(5)
+    time.sleep(0.1)
+    fetch.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert fetch.calls == ["cid"]
+    assert not results
+    assert len(errors) == 3 and all(error is errors[0] for error in errors)
+
+
+def test_other_worker_waits_for_the_fetch_lock(path):
+    # Two caches on one database behave like two gunicorn workers
+    leader_fetch, follower_fetch = BlockingFetch(), FakeFetch()
+    leader = youtube.YouTubeCache(path=path, fetch=leader_fetch)
+    follower = youtube.YouTubeCache(path=path, fetch=follower_fetch, poll_interval=0.01)
+    threads, results, errors = run_concurrently(lambda: leader.get("cid"), 1)
+    assert leader_fetch.started.wait(5)
+    waiting, follower_results, _ = run_concurrently(lambda: follower.get("cid"), 1)
+    time.sleep(0.1)
+    leader_fetch.release.set()
+    for thread in threads + waiting:
+        thread.join(5)
+    assert follower_fetch.calls == []
+    assert follower_results == results
+    assert follower.stats["coalesced"] == 1
+    assert db.get_connection(path).execute(
+        "SELECT COUNT(*) FROM youtube_fetch_locks").fetchone()[0] == 0
+
+
+def test_other_worker_gets_the_error(path):
+    leader_fetch = BlockingFetch()
+    leader_fetch.error = RuntimeError("quota exceeded")
+    leader = youtube.YouTubeCache(path=path, fetch=leader_fetch)
+    follower = youtube.YouTubeCache(path=path, fetch=FakeFetch(), poll_interval=0.01)
+    threads, _, _ = run_concurrently(lambda: leader.get("cid"), 1)
+    assert leader_fetch.started.wait(5)
+    waiting, _, follower_errors = run_concurrently(lambda: follower.get("cid"), 1)
+    time.sleep(0.1)
+    leader_fetch.release.set()
+    for thread in threads + waiting:
+        thread.join(5)
+    assert len(follower_errors) == 1
+    assert isinstance(follower_errors[0], youtube.YouTubeFetchError)
+    assert str(follower_errors[0]) == "RuntimeError"
+    # The failed lock does not block the next attempt
+    assert follower.get("cid")["channel_id"] == "cid"
+
+
+def test_shared_fetch_error_does_not_leak_the_api_key(path):
+    def fetch(channel_id):
+        response = requests.Response()
+        response.status_code = 403
+        raise requests.HTTPError(
+            f"403 Client Error for url: {youtube.YOUTUBE_SEARCH_URL}"
+            f"?key=SECRETKEY&channelId={channel_id}", response=response)
+
+    cache = make_cache(path, fetch, FakeClock())
+    with pytest.raises(requests.HTTPError):
+        cache.get("cid")
+    error = db.get_connection(path).execute(
+        "SELECT error FROM youtube_fetch_locks WHERE channel_id = 'cid'").fetchone()[0]
+    assert error == "HTTP 403"
+
+
+def test_refresh_skips_a_channel_another_worker_just_fetched(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    worker_a = make_cache(path, fetch, clock)
+    worker_b = make_cache(path, fetch, clock)
+    worker_a.get("cid")
+    clock.now += 120
+
+    # Both saw the stale entry; B's refresh lands before A takes the lock
+    refreshed = worker_b.refresh("cid")
+    assert worker_a.refresh("cid", background=True) == refreshed
+    assert len(fetch.calls) == 2
+    assert worker_a.stats["coalesced"] == 1
+    conn = db.get_connection(path)
+    assert conn.execute("SELECT COUNT(*) FROM youtube_fetch_locks").fetchone()[0] == 0
+
+
+def test_lock_of_a_dead_worker_expires(path):
+    conn = db.get_connection(path)
+    with conn:
+        conn.execute("INSERT INTO youtube_fetch_locks (channel_id, owner, expires_at) "
+                     "VALUES ('cid', 'dead', ?)", (time.time() + 0.2,))
+    fetch = FakeFetch()
+    cache = youtube.YouTubeCache(path=path, fetch=fetch, poll_interval=0.01)
+    started = time.monotonic()
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+    assert time.monotonic() - started >= 0.15
+    assert fetch.calls == ["cid"]
+
+
+def test_budget_charges_atomically_up_to_the_limit(path):
+    conn = db.get_connection(path)
+    budget = youtube.QuotaBudget(daily_quota=300, reserve=100)
+    assert budget.charge(conn, 100, background=True)
+    assert budget.charge(conn, 100, background=True)
+    # Background work stops at the reserve; requests may use it
+    assert not budget.charge(conn, 100, background=True)
+    assert budget.charge(conn, 100)
+    assert not budget.charge(conn, 100)
+    assert budget.usage(conn) == {"day": budget.day(), "units": 300, "calls": 3,
+                                  "limit": 300, "remaining": 0}
+
+
+def test_budget_day_follows_pacific_midnight():
+    budget = youtube.QuotaBudget()
+    # 2024-01-02 07:59 UTC is still Jan 1 in California
+    before = 1704182340
+    assert budget.day(before) == "2024-01-01"
+    assert budget.day(before + 120) == "2024-01-02"
+    assert budget.seconds_until_reset(before) == 60
+
+
+def test_spent_budget_serves_cached_data(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    budget = youtube.QuotaBudget(daily_quota=200, reserve=100)
+    cache = make_cache(path, fetch, clock, budget=budget)
+    cache.get("cid")
+    # Stale: no background refresh once only the reserve is left
+    clock.now += 120
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+    assert cache.stats["degraded"] == 1
+    # A new channel may still use the reserve
+    cache.get("other")
+    # Past the stale window the old entry beats failing
+    clock.now += 1000
+    assert cache.get("cid")["videos"] == [{"id": "v1"}]
+    assert cache.stats["degraded"] == 2
+    with pytest.raises(youtube.QuotaExhausted):
+        cache.get("third")
+    assert fetch.calls == ["cid", "other"]
+
+
+def test_scheduler_splits_budget_by_popularity(path):
+    conn = db.get_connection(path)
+    fetch, clock = FakeFetch(), FakeClock()
+    budget = youtube.QuotaBudget(daily_quota=10000, reserve=0)
+    cache = make_cache(path, fetch, clock, budget=budget)
+    scheduler = youtube.RefreshScheduler(cache, budget, clock=clock)
+    for _ in range(9):
+        cache.get("popular")
+    cache.get("niche")
+    scheduler.record_requests(conn, clock.now)
+
+    plan = {channel_id: interval for channel_id, _, interval in scheduler.plan(conn, clock.now)}
+    assert plan["popular"] < plan["niche"]
+    # 98 calls left today: 9/10 of them for popular, 1/10 for niche
+    seconds_left = budget.seconds_until_reset(clock.now)
+    assert plan["niche"] == pytest.approx(max(seconds_left / 9.8, cache.fresh_ttl))
+
+
+def test_scheduler_refreshes_due_channels_within_budget(path):
+    conn = db.get_connection(path)
+    fetch, clock = FakeFetch(), FakeClock()
+    clock.now = 1704225600  # noon Pacific
+    budget = youtube.QuotaBudget(daily_quota=400, reserve=100, clock=clock)
+    cache = make_cache(path, fetch, clock, budget=budget)
+    scheduler = youtube.RefreshScheduler(cache, budget, clock=clock)
+    cache.get("a")
+    cache.get("b")
+    cache.get("b")
+    assert scheduler.run_once(conn) == []
+
+    # Late in the same quota day both are due, but only one background
+    # call fits before the reserve; the most popular channel wins
+    clock.now += budget.seconds_until_reset() - 600
+    assert scheduler.run_once(conn) == ["b"]
+    assert scheduler.stats["skipped_for_quota"] == 1
+    assert fetch.calls == ["a", "b", "b"]
+
+
+def test_scheduler_scores_decay(path):
+    conn = db.get_connection(path)
+    cache = make_cache(path, FakeFetch(), FakeClock())
+    scheduler = youtube.RefreshScheduler(cache, youtube.QuotaBudget(), half_life=100)
+    for _ in range(8):
+        cache.get("cid")
+    scheduler.record_requests(conn, 1000)
+    cache.get("cid")
+    scheduler.record_requests(conn, 1100)
+    assert conn.execute("SELECT score FROM youtube_channels").fetchone()[0] == 5
+
+
+def test_request_counts_are_bounded(path):
+    fetch, clock = FakeFetch(), FakeClock()
+    cache = make_cache(path, fetch, clock, max_tracked=2)
+    for channel_id in ("a", "b", "c", "a"):
+        cache.get(channel_id)
+    fetch.error = RuntimeError("no such channel")
+    with pytest.raises(RuntimeError):
+        cache.get("bogus")
+    assert cache.take_request_counts() == {"a": 2, "b": 1}
+
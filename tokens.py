@@ -0,0 +1,267 @@
+"""Bearer tokens: resolution, expiry and an in-process cache.
+
+Authenticated requests resolve ``Authorization: Bearer <token>`` to
+``(user_id, is_premium)``. The cache keeps recent results for a short TTL
+so the hot path is a dict lookup. Revocations made by other workers are
+picked up through the 'tokens' change counter (migration 5), which is
+polled at most once per TOKEN_CACHE_CHECK_INTERVAL seconds.
+
+Tokens expire TOKEN_TTL seconds after their last use (sliding sessions),
+and never later than TOKEN_MAX_AGE after they were issued. TokenSweeper
+deletes expired rows in small batches so the table stays small.
+"""
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from db import connect
+
+TOKEN_TTL = float(os.getenv('TOKEN_TTL', 30 * 24 * 3600))
+# Absolute lifetime cap; 0 disables it.
+TOKEN_MAX_AGE = float(os.getenv('TOKEN_MAX_AGE', 180 * 24 * 3600))
+# A used token's expiry is pushed forward at most this often, so active
+# sessions don't turn every request into a write.
+TOKEN_REFRESH_INTERVAL = float(os.getenv('TOKEN_REFRESH_INTERVAL', 24 * 3600))
+
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 60))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_CHECK_INTERVAL = float(os.getenv('TOKEN_CACHE_CHECK_INTERVAL', 1))
+
+TOKEN_SWEEP_INTERVAL = float(os.getenv('TOKEN_SWEEP_INTERVAL', 300))
+TOKEN_SWEEP_BATCH = int(os.getenv('TOKEN_SWEEP_BATCH', 500))
+# Pause between batches so other writers can take the lock.
+TOKEN_SWEEP_PAUSE = float(os.getenv('TOKEN_SWEEP_PAUSE', 0.05))
+
+logger = logging.getLogger(__name__)
+
+
+def issue_token(conn, user_id, now=None):
+    """Create and store a new token for ``user_id``."""
+    now = int(time.time() if now is None else now)
+    token = secrets.token_urlsafe(32)
+    with conn:
+        conn.execute(
+            'INSERT INTO tokens (token, user_id, expires_at) VALUES (?, ?, ?)',
+            (token, user_id, now + int(TOKEN_TTL)))
+    return token
+
+
+def _fetch(conn, token, now):
+    """Return ((user_id, is_premium), expires_at) for a live token, or None.
+
+    Slides the expiry forward when the token has not been refreshed for
+    TOKEN_REFRESH_INTERVAL. Tokens inserted without an expiry get one on
+    first use.
+    """
+    row = conn.execute(
+        '''
+        SELECT tokens.user_id, users.is_premium, tokens.expires_at,
+               CAST(strftime('%s', tokens.created_at) AS INTEGER)
+        FROM tokens JOIN users ON users.id = tokens.user_id
+        WHERE tokens.token = ? AND (tokens.expires_at IS NULL OR tokens.expires_at > ?)
+        ''',
+        (token, now),
+    ).fetchone()
+    if row is None:
+        return None
+    user_id, is_premium, expires_at, created_at = row
+    if expires_at is None or expires_at - now < TOKEN_TTL - TOKEN_REFRESH_INTERVAL:
+        new_expiry = now + int(TOKEN_TTL)
+        if TOKEN_MAX_AGE and created_at is not None:
+            new_expiry = min(new_expiry, created_at + int(TOKEN_MAX_AGE))
+        if new_expiry <= now:
+            return None
+        if new_expiry != expires_at:
+            with conn:
+                conn.execute('UPDATE tokens SET expires_at = ? WHERE token = ?',
+                             (new_expiry, token))
+            expires_at = new_expiry
+    return (user_id, bool(is_premium)), expires_at
+
+
+def lookup_token(conn, token, now=None):
+    """Resolve a token against the database; None if unknown or expired."""
+    found = _fetch(conn, token, int(time.time() if now is None else now))
+    return found[0] if found else None
+
+
+def change_counter(conn):
+    row = conn.execute(
+        "SELECT version FROM table_versions WHERE name = 'tokens'").fetchone()
+    return row[0] if row else 0
+
+
+class TokenCache:
+    """Bounded TTL cache of token -> (user_id, is_premium).
+
+    Unknown tokens are not cached, so a token issued by another worker
+    works immediately. Entries never outlive the token's own expiry.
+    """
+
+    def __init__(self, ttl=TOKEN_CACHE_TTL, max_entries=TOKEN_CACHE_SIZE,
+                 check_interval=TOKEN_CACHE_CHECK_INTERVAL, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+
+    def resolve(self, conn, token):
+        now = self._clock()
+        self._check_version(conn, now)
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        found = _fetch(conn, token, int(now))
+        if found is None:
+            return None
+        identity, expires_at = found
+        cached_until = now + self.ttl
+        if expires_at is not None:
+            cached_until = min(cached_until, expires_at)
+        with self._lock:
+            self._entries[token] = (identity, cached_until)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, token=None, user_id=None):
+        """Drop one token, every token of a user, or (no args) everything."""
+        with self._lock:
+            if token is None and user_id is None:
+                self._entries.clear()
+                return
+            if token is not None:
+                self._entries.pop(token, None)
+            if user_id is not None:
+                for key in [key for key, (identity, _) in self._entries.items()
+                            if identity[0] == user_id]:
+                    del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_version(self, conn, now):
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        version = change_counter(conn)
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+            self._version = version
+            self._checked_at = now
+
+
+token_cache = TokenCache()
+
+
+def revoke_token(conn, token, cache=token_cache):
+    """Delete a token (logout) and drop it from this worker's cache."""
+    with conn:
+        conn.execute('DELETE FROM tokens WHERE token = ?', (token,))
+    cache.invalidate(token=token)
+
+
+def revoke_user_tokens(conn, user_id, cache=token_cache):
+    """Delete every token of a user (logout everywhere, password change)."""
+    with conn:
+        conn.execute('DELETE FROM tokens WHERE user_id = ?', (user_id,))
+    cache.invalidate(user_id=user_id)
+
+
+def sweep_expired(conn, now=None, batch_size=TOKEN_SWEEP_BATCH,
+                  pause=TOKEN_SWEEP_PAUSE):
+    """Delete expired tokens in short transactions; returns rows deleted.
+
+    Each batch is its own transaction of at most ``batch_size`` rows found
+    through idx_tokens_expires_at, so the write lock is only held briefly.
+    """
+    now = int(time.time() if now is None else now)
+    deleted = 0
+    while True:
+        with conn:
+            # Rows without an expiry were never used since they were
+            # inserted; they expire TOKEN_TTL after creation.
+            cursor = conn.execute(
+                '''
+                DELETE FROM tokens WHERE rowid IN (
+                    SELECT rowid FROM tokens
+                    WHERE expires_at <= ?
+                       OR (expires_at IS NULL
+                           AND created_at <= datetime(?, 'unixepoch'))
+                    LIMIT ?
+                )
+                ''',
+                (now, now - int(TOKEN_TTL), batch_size),
+            )
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def token_table_stats(conn, now=None):
+    now = int(time.time() if now is None else now)
+    total, expired = conn.execute(
+        'SELECT COUNT(*), COUNT(CASE WHEN expires_at <= ? THEN 1 END) FROM tokens',
+        (now,),
+    ).fetchone()
+    return {'tokens': total, 'expired_pending': expired}
+
+
+class TokenSweeper(threading.Thread):
+    """Daemon thread running sweep_expired every ``interval`` seconds.
+
+    Uses its own connection. ``stats`` holds the table size after the last
+    sweep and running totals, for exporting as metrics.
+    """
+
+    def __init__(self, path=None, interval=TOKEN_SWEEP_INTERVAL,
+                 batch_size=TOKEN_SWEEP_BATCH):
+        super().__init__(name='token-sweeper', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stats = {'tokens': None, 'expired_pending': None,
+                      'deleted_total': 0, 'last_deleted': 0, 'last_sweep_at': None}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = connect(self.path)
+        try:
+            while not self._stop_event.is_set():
+                self.sweep_once(conn)
+                self._stop_event.wait(self.interval)
+        finally:
+            conn.close()
+
+    def sweep_once(self, conn):
+        try:
+            deleted = sweep_expired(conn, batch_size=self.batch_size)
+            self.stats.update(token_table_stats(conn))
+        except Exception:
+            logger.exception('Token sweep failed')
+            return
+        self.stats['last_deleted'] = deleted
+        self.stats['deleted_total'] += deleted
+        self.stats['last_sweep_at'] = time.time()
+        if deleted:
+            logger.info('Swept %d expired tokens (%d remaining)',
+                        deleted, self.stats['tokens'])
+
+    def stop(self):
+        self._stop_event.set()
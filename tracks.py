@@ -0,0 +1,243 @@
+"""Queries on the tracks table used by the /api/tracks endpoints."""
+import html
+import itertools
+import json
+import re
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_TERMS = 8
+
+MAX_TITLE_LENGTH = 200
+MAX_URL_LENGTH = 500
+# Rows per executemany transaction in a bulk import
+IMPORT_CHUNK_SIZE = 500
+# Per-row errors returned to the client; further failures are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# Control characters used as highlight markers; they cannot occur in a
+# title, so the title can be HTML-escaped before <mark> tags are added.
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+TRACK_COLUMNS = ('id', 'title', 'url')
+
+
+def parse_page_args(args):
+    """Read ``after`` and ``limit`` from request args.
+
+    Raises ValueError for values that are not non-negative integers;
+    limit is clamped to MAX_PAGE_SIZE.
+    """
+    after = int(args.get('after') or 0)
+    limit = int(args.get('limit') or DEFAULT_PAGE_SIZE)
+    if after < 0 or limit < 1:
+        raise ValueError('after must be >= 0 and limit >= 1')
+    return after, min(limit, MAX_PAGE_SIZE)
+
+
+def list_tracks(conn, after=0, limit=DEFAULT_PAGE_SIZE):
+    """Return one page of tracks with ``id > after``, oldest first.
+
+    Keyset pagination on the integer primary key: every page is a single
+    index range seek, however deep the client has paged. Returns
+    ``(tracks, next_cursor)``; next_cursor is None on the last page.
+    """
+    rows = conn.execute(
+        'SELECT id, title, url FROM tracks WHERE id > ? ORDER BY id LIMIT ?',
+        (after, limit + 1),
+    ).fetchall()
+    tracks = [dict(zip(TRACK_COLUMNS, row)) for row in rows[:limit]]
+    next_cursor = tracks[-1]['id'] if len(rows) > limit else None
+    return tracks, next_cursor
+
+
+def table_version(conn, name='tracks'):
+    """Change counter maintained by triggers (see migration 3)."""
+    row = conn.execute(
+        'SELECT version FROM table_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def tracks_etag(conn):
+    """Strong ETag for any page of the track list.
+
+    Changes whenever a track is inserted, updated or deleted, so an
+    unchanged list can be answered with 304 without running the query.
+    """
+    return f'"tracks-{table_version(conn)}"'
+
+
+def build_match_query(text):
+    """Turn free text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so FTS syntax in the input is
+    never interpreted and "tie" matches "Tiësto". Returns None when the
+    text has no searchable words.
+    """
+    terms = _TERM_RE.findall(text)[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_tracks(conn, text, limit=DEFAULT_SEARCH_LIMIT):
+    """Full-text search over track titles, best bm25 match first.
+
+    Each result carries ``highlight``: the HTML-escaped title with matched
+    words wrapped in <mark>.
+    """
+    query = build_match_query(text)
+    if query is None:
+        return []
+    rows = conn.execute(
+        """
+        SELECT tracks.id, tracks.title, tracks.url,
+               highlight(tracks_fts, 0, ?, ?)
+        FROM tracks_fts
+        JOIN tracks ON tracks.id = tracks_fts.rowid
+        WHERE tracks_fts MATCH ?
+        ORDER BY bm25(tracks_fts)
+        LIMIT ?
+        """,
+        (_MARK_START, _MARK_END, query, min(limit, MAX_PAGE_SIZE)),
+    ).fetchall()
+    results = []
+    for row in rows:
+        track = dict(zip(TRACK_COLUMNS, row[:3]))
+        track['highlight'] = (html.escape(row[3])
+                              .replace(_MARK_START, '<mark>')
+                              .replace(_MARK_END, '</mark>'))
+        results.append(track)
+    return results
+
+
+def validate_track(record):
+    """Return an error message for an invalid track payload, else None."""
+    if not isinstance(record, dict):
+        return 'Track must be a JSON object'
+    title = record.get('title')
+    url = record.get('url')
+    if not isinstance(title, str) or not title.strip():
+        return 'Title is required'
+    if not isinstance(url, str) or not url.strip():
+        return 'URL is required'
+    if len(title) > MAX_TITLE_LENGTH:
+        return f'Title must be at most {MAX_TITLE_LENGTH} characters'
+    if len(url) > MAX_URL_LENGTH:
+        return f'URL must be at most {MAX_URL_LENGTH} characters'
+    return None
+
+
+def iter_ndjson(lines):
+    """Yield one parsed record per non-blank line.
+
+    A line that is not valid JSON yields a ValueError in its place, so the
+    remaining lines are still imported.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield ValueError(f'Invalid JSON: {exc}')
+
+
+def iter_json_array(stream, buffer='', chunk_size=64 * 1024):
+    """Yield the elements of a top-level JSON array read from a text stream.
+
+    Elements are decoded as soon as they are complete, so the whole body
+    is never held in memory. A syntax error yields a ValueError and ends
+    the stream, since there is no reliable way to resynchronise.
+    """
+    decoder = json.JSONDecoder()
+    eof = False
+    started = False
+    while True:
+        buffer = buffer.lstrip()
+        # Refill when the buffer is empty; a value that ends exactly at
+        # the end of the buffer (e.g. a number) may still be incomplete.
+        if not eof and len(buffer) < 2:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        if not buffer:
+            if started:
+                yield ValueError('Unexpected end of JSON array')
+            return
+        if not started:
+            if buffer[0] != '[':
+                yield ValueError('Expected a JSON array')
+                return
+            started = True
+            buffer = buffer[1:]
+        elif buffer[0] == ']':
+            return
+        elif buffer[0] == ',':
+            buffer = buffer[1:]
+        else:
+            try:
+                record, end = decoder.raw_decode(buffer)
+                if end == len(buffer) and not eof:
+                    raise ValueError('Value may continue in the next chunk')
+            except ValueError as exc:
+                if eof:
+                    yield ValueError(f'Invalid JSON: {exc}')
+                    return
+                chunk = stream.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            yield record
+
+
+def iter_records(stream):
+    """Stream records from a text body holding a JSON array or NDJSON.
+
+    The format is detected from the first non-blank character.
+    """
+    first = stream.read(1)
+    while first.isspace():
+        first = stream.read(1)
+    if first == '[':
+        return iter_json_array(stream, buffer=first)
+    return iter_ndjson(itertools.chain([first + stream.readline()], stream))
+
+
+def import_tracks(conn, records, chunk_size=IMPORT_CHUNK_SIZE):
+    """Validate and insert tracks from an iterable of records.
+
+    Valid rows are inserted with executemany, one transaction per chunk.
+    Invalid rows are reported by their 1-based position and skipped; they
+    never abort the rest of the batch.
+    """
+    inserted = 0
+    failed = 0
+    errors = []
+    batch = []
+
+    def flush():
+        nonlocal inserted
+        with conn:
+            conn.executemany('INSERT INTO tracks (title, url) VALUES (?, ?)', batch)
+        inserted += len(batch)
+        batch.clear()
+
+    for row, record in enumerate(records, 1):
+        error = str(record) if isinstance(record, Exception) else validate_track(record)
+        if error:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': row, 'error': error})
+            continue
+        batch.append((record['title'], record['url']))
+        if len(batch) >= chunk_size:
+            flush()
+    if batch:
+        flush()
+    return {'inserted': inserted, 'failed': failed, 'errors': errors}
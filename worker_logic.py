@@ -0,0 +1,128 @@
+"""Answer chat questions with the OpenAI chat completions API.
+
+Mirrors the /api/ask handler of the Cloudflare worker (workers-site).
+Requests go through one shared requests.Session per process. Its pooled
+keep-alive connections spare each question a TCP and TLS handshake.
+Responses with status 429 or 5xx are retried with exponential backoff,
+honouring Retry-After up to OPENAI_MAX_RETRY_AFTER seconds. The last
+response is then raised as HTTPError like before.
+
+ask_stream() yields the answer as OpenAI streams it (``"stream": true``).
+"""
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OPENAI_URL = 'https://api.openai.com/v1/chat/completions'
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+SYSTEM_PROMPT = 'You are an AI DJ assistant for TheBadGuyHimself.'
+
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 30))
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', 10))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+OPENAI_MAX_RETRY_AFTER = float(os.getenv('OPENAI_MAX_RETRY_AFTER', 20))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CappedRetry(Retry):
+    """Retry that waits at most ``max_retry_after`` for Retry-After."""
+
+    max_retry_after = OPENAI_MAX_RETRY_AFTER
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.max_retry_after)
+
+
+def make_session(pool_size=OPENAI_POOL_SIZE, max_retries=OPENAI_MAX_RETRIES):
+    retry = CappedRetry(
+        total=max_retries,
+        connect=max_retries,
+        # The request reached the server; retrying could pay for it twice.
+        # False (not 0) re-raises the read timeout itself, as plain
+        # requests would, instead of wrapping it in a ConnectionError.
+        read=False,
+        status=max_retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'POST'}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=retry, pool_block=False)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return this process's shared session, creating it after a fork."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = make_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def _post(question, api_key, stream=False):
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    payload = {
+        'model': OPENAI_MODEL,
+        'messages': [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': question},
+        ],
+    }
+    if stream:
+        payload['stream'] = True
+    response = get_session().post(
+        OPENAI_URL,
+        headers={'Authorization': f'Bearer {api_key}'},
+        json=payload,
+        timeout=OPENAI_TIMEOUT,
+        stream=stream,
+    )
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        # Hand a streamed connection back to the pool
+        response.close()
+        raise
+    return response
+
+
+def ask(question, api_key=None):
+    """Send ``question`` to OpenAI; returns the completion response JSON."""
+    return _post(question, api_key).json()
+
+
+def ask_stream(question, api_key=None):
+    """Yield the answer to ``question`` in pieces as OpenAI generates it."""
+    with _post(question, api_key, stream=True) as response:
+        # text/event-stream carries no charset; the API sends UTF-8
+        response.encoding = 'utf-8'
+        for line in response.iter_lines(decode_unicode=True):
+            if not line.startswith('data: '):
+                continue
+            data = line[len('data: '):]
+            if data == '[DONE]':
+                return
+            choices = json.loads(data).get('choices') or [{}]
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                yield content
@@ -0,0 +1,606 @@
+"""Latest videos of a YouTube channel, behind a two-tier cache.
+
+Every call to the YouTube Data API search endpoint costs quota, so
+/api/youtube answers from YouTubeCache: an in-process LRU in front of the
+youtube_cache table (migration 7), which survives restarts and is shared
+by all workers. Entries younger than YOUTUBE_FRESH_TTL are served as they
+are. For YOUTUBE_STALE_TTL seconds after that they are still served
+immediately while one background thread per channel refreshes them. Only
+older entries, or unknown channels, make the request wait for the API.
+
+Fetches are single-flight: concurrent requests for one channel share a
+single upstream call and its result or error, across threads through
+SingleFlight and across worker processes through the
+youtube_fetch_locks table (migration 8).
+
+Each call costs YOUTUBE_SEARCH_COST units of the daily API quota.
+QuotaBudget records them in youtube_quota_usage (migration 9). When the
+budget is nearly spent, the cache serves what it has, however old,
+instead of failing. RefreshScheduler keeps popular channels fresh ahead
+of requests, spreading the remaining budget over the day.
+"""
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import requests
+
+from db import connect, get_connection
+
+YOUTUBE_SEARCH_URL = 'https://www.googleapis.com/youtube/v3/search'
+YOUTUBE_MAX_RESULTS = int(os.getenv('YOUTUBE_MAX_RESULTS', 10))
+YOUTUBE_TIMEOUT = float(os.getenv('YOUTUBE_TIMEOUT', 10))
+
+YOUTUBE_FRESH_TTL = float(os.getenv('YOUTUBE_FRESH_TTL', 15 * 60))
+YOUTUBE_STALE_TTL = float(os.getenv('YOUTUBE_STALE_TTL', 24 * 3600))
+YOUTUBE_CACHE_SIZE = int(os.getenv('YOUTUBE_CACHE_SIZE', 256))
+# Distinct channels whose requests are counted between scheduler runs
+YOUTUBE_TRACKED_CHANNELS = int(os.getenv('YOUTUBE_TRACKED_CHANNELS', 1024))
+
+# A worker that dies mid-fetch holds the channel's lock this long at most
+YOUTUBE_FETCH_LOCK_TTL = float(os.getenv('YOUTUBE_FETCH_LOCK_TTL', 3 * YOUTUBE_TIMEOUT))
+YOUTUBE_LOCK_POLL_INTERVAL = float(os.getenv('YOUTUBE_LOCK_POLL_INTERVAL', 0.05))
+
+# search.list costs 100 units of the default 10,000 a day. The quota
+# resets at midnight Pacific time.
+YOUTUBE_DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA', 10000))
+YOUTUBE_SEARCH_COST = 100
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+# Units kept back for channels with nothing cached; background and
+# scheduled refreshes stop when only this much is left.
+YOUTUBE_QUOTA_RESERVE = int(os.getenv('YOUTUBE_QUOTA_RESERVE', 2000))
+
+YOUTUBE_SCHEDULER_INTERVAL = float(os.getenv('YOUTUBE_SCHEDULER_INTERVAL', 60))
+# A channel's request score halves over this many seconds
+YOUTUBE_POPULARITY_HALF_LIFE = float(os.getenv('YOUTUBE_POPULARITY_HALF_LIFE', 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+
+def get_latest_videos(channel_id, api_key=None, max_results=YOUTUBE_MAX_RESULTS):
+    """Fetch the newest videos of a channel from the YouTube Data API."""
+    api_key = api_key or os.getenv('YOUTUBE_API_KEY')
+    if not api_key:
+        raise RuntimeError('YOUTUBE_API_KEY is not set')
+    # The key goes in a header: URLs end up in exceptions and logs
+    response = requests.get(
+        YOUTUBE_SEARCH_URL,
+        headers={'X-Goog-Api-Key': api_key},
+        params={
+            'channelId': channel_id,
+            'part': 'snippet',
+            'order': 'date',
+            'type': 'video',
+            'maxResults': max_results,
+        },
+        timeout=YOUTUBE_TIMEOUT,
+    )
+    response.raise_for_status()
+    videos = []
+    for item in response.json().get('items', []):
+        video_id = item.get('id', {}).get('videoId')
+        if not video_id:
+            continue
+        snippet = item.get('snippet', {})
+        videos.append({
+            'id': video_id,
+            'title': snippet.get('title', ''),
+            'published_at': snippet.get('publishedAt'),
+            'thumbnail': snippet.get('thumbnails', {}).get('medium', {}).get('url'),
+            'url': f'https://www.youtube.com/watch?v={video_id}',
+        })
+    return {'channel_id': channel_id, 'videos': videos}
+
+
+class YouTubeFetchError(Exception):
+    """A fetch made by another worker process failed with this message."""
+
+
+class QuotaExhausted(YouTubeFetchError):
+    """The day's quota budget does not cover another call."""
+
+
+def _error_summary(exc):
+    """What other workers are told about a failed fetch.
+
+    Exception text from requests carries the request URL, which may hold
+    the API key, so only our own messages are passed on verbatim.
+    """
+    if isinstance(exc, YouTubeFetchError):
+        return str(exc)
+    response = getattr(exc, 'response', None)
+    if isinstance(exc, requests.HTTPError) and response is not None:
+        return f'HTTP {response.status_code}'
+    return type(exc).__name__
+
+
+class QuotaBudget:
+    """The daily YouTube quota, shared by all workers.
+
+    Units are charged before each call, atomically against the limit, so
+    concurrent workers cannot overspend it together. Background work may
+    only spend up to ``daily_quota - reserve``.
+    """
+
+    def __init__(self, daily_quota=YOUTUBE_DAILY_QUOTA, reserve=YOUTUBE_QUOTA_RESERVE,
+                 clock=time.time):
+        self.daily_quota = daily_quota
+        self.reserve = reserve
+        self._clock = clock
+
+    def day(self, now=None):
+        now = self._clock() if now is None else now
+        return datetime.fromtimestamp(now, QUOTA_TIMEZONE).date().isoformat()
+
+    def seconds_until_reset(self, now=None):
+        now = self._clock() if now is None else now
+        local = datetime.fromtimestamp(now, QUOTA_TIMEZONE)
+        midnight = datetime.combine(local.date() + timedelta(days=1),
+                                    datetime.min.time(), QUOTA_TIMEZONE)
+        return midnight.timestamp() - now
+
+    def limit(self, background=False):
+        return self.daily_quota - (self.reserve if background else 0)
+
+    def used(self, conn, now=None):
+        row = conn.execute('SELECT units FROM youtube_quota_usage WHERE day = ?',
+                           (self.day(now),)).fetchone()
+        return row[0] if row else 0
+
+    def remaining(self, conn, background=False, now=None):
+        return max(self.limit(background) - self.used(conn, now), 0)
+
+    def can_spend(self, conn, units, background=False, now=None):
+        return self.remaining(conn, background, now) >= units
+
+    def charge(self, conn, units, background=False, now=None):
+        """Record ``units`` for today if they fit; returns whether they did."""
+        limit = self.limit(background)
+        if units > limit:
+            return False
+        with conn:
+            cursor = conn.execute(
+                '''
+                INSERT INTO youtube_quota_usage (day, units, calls) VALUES (?, ?, 1)
+                ON CONFLICT (day) DO UPDATE
+                SET units = units + excluded.units, calls = calls + 1
+                WHERE units + excluded.units <= ?
+                ''',
+                (self.day(now), units, limit))
+        return cursor.rowcount == 1
+
+    def usage(self, conn, now=None):
+        """Today's spend, for exporting as metrics."""
+        day = self.day(now)
+        row = conn.execute('SELECT units, calls FROM youtube_quota_usage WHERE day = ?',
+                           (day,)).fetchone()
+        units, calls = row if row else (0, 0)
+        return {'day': day, 'units': units, 'calls': calls,
+                'limit': self.daily_quota, 'remaining': max(self.daily_quota - units, 0)}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one.
+
+    The first caller runs ``fn``; callers arriving before it finishes wait
+    and get the same result, or the same exception raised again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """Return ``(result, shared)``; shared is True for the waiters."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn(*args)
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class YouTubeCache:
+    """Stale-while-revalidate cache of channel_id -> get_latest_videos().
+
+    ``fetch`` is called with the channel id. Database access goes through
+    the per-thread pooled connections of ``path``. ``stats`` counts fresh
+    hits, stale hits, misses, background refreshes, fetches answered by
+    another caller's upstream call (coalesced) and entries served past
+    their window because the quota ``budget`` was spent (degraded), for
+    exporting as metrics.
+    """
+
+    def __init__(self, path=None, fetch=get_latest_videos,
+                 fresh_ttl=YOUTUBE_FRESH_TTL, stale_ttl=YOUTUBE_STALE_TTL,
+                 max_entries=YOUTUBE_CACHE_SIZE, lock_ttl=YOUTUBE_FETCH_LOCK_TTL,
+                 poll_interval=YOUTUBE_LOCK_POLL_INTERVAL, budget=None,
+                 cost=YOUTUBE_SEARCH_COST, max_tracked=YOUTUBE_TRACKED_CHANNELS,
+                 clock=time.time):
+        self.path = path
+        self.fetch = fetch
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.budget = budget
+        self.cost = cost
+        self.max_tracked = max_tracked
+        self.stats = {'hits': 0, 'stale': 0, 'misses': 0, 'coalesced': 0,
+                      'degraded': 0, 'refreshes': 0, 'refresh_errors': 0}
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._requests = Counter()
+        self._flight = SingleFlight()
+        self._refreshing = {}
+        self._lock = threading.Lock()
+
+    def get(self, channel_id):
+        """Return the cached payload, fetching it first if there is none
+        usable. Fetch errors on a miss propagate to the caller."""
+        payload = self._get(channel_id)
+        # Counted once answered, so ids that fail to fetch are not
+        # tracked, and for at most max_tracked channels until the
+        # scheduler takes the counts.
+        with self._lock:
+            if channel_id in self._requests or len(self._requests) < self.max_tracked:
+                self._requests[channel_id] += 1
+        return payload
+
+    def _get(self, channel_id):
+        entry = self._lookup(channel_id)
+        if entry is not None:
+            payload, fetched_at = entry
+            age = self._clock() - fetched_at
+            if age < self.fresh_ttl:
+                self._count('hits')
+                return payload
+            if age < self.fresh_ttl + self.stale_ttl:
+                self._count('stale')
+                if self._can_spend(background=True):
+                    self._refresh_in_background(channel_id)
+                else:
+                    self._count('degraded')
+                return payload
+            if not self._can_spend():
+                self._count('degraded')
+                return payload
+        self._count('misses')
+        return self.refresh(channel_id)
+
+    def refresh(self, channel_id, conn=None, background=False):
+        """Fetch ``channel_id`` now and store it in both tiers.
+
+        Joins a fetch of the same channel already running in this process
+        or another worker instead of starting a second one, and returns
+        the stored payload if it is still fresh by the time the fetch lock
+        is taken. Raises
+        QuotaExhausted when the budget does not cover the call;
+        ``background`` calls leave the budget's reserve alone.
+        """
+        payload, shared = self._flight.do(channel_id, self._fetch_once, channel_id,
+                                          conn or get_connection(self.path), background)
+        if shared:
+            self._count('coalesced')
+        return payload
+
+    def take_request_counts(self):
+        """Return and reset the per-channel request counts."""
+        with self._lock:
+            counts, self._requests = self._requests, Counter()
+        return counts
+
+    def _can_spend(self, background=False):
+        return self.budget is None or self.budget.can_spend(
+            get_connection(self.path), self.cost, background)
+
+    def _fetch_once(self, channel_id, conn, background):
+        owner = secrets.token_hex(8)
+        started = self._clock()
+        while not self._acquire(conn, channel_id, owner):
+            payload = self._wait_for_other_worker(conn, channel_id, started)
+            if payload is not None:
+                self._count('coalesced')
+                return payload
+        payload = self._fresh_row(conn, channel_id)
+        if payload is not None:
+            # Another worker refreshed it between our lookup and the lock
+            with conn:
+                conn.execute('DELETE FROM youtube_fetch_locks '
+                             'WHERE channel_id = ? AND owner = ?', (channel_id, owner))
+            self._count('coalesced')
+            return payload
+        try:
+            if self.budget is not None and not self.budget.charge(conn, self.cost, background):
+                raise QuotaExhausted(f'YouTube quota budget for {self.budget.day()} is spent')
+            payload = self.fetch(channel_id)
+        except Exception as exc:
+            # Expire the lock at once, leaving the error for the waiters
+            with conn:
+                conn.execute(
+                    'UPDATE youtube_fetch_locks SET error = ?, expires_at = ? '
+                    'WHERE channel_id = ? AND owner = ?',
+                    (_error_summary(exc), self._clock(), channel_id, owner))
+            raise
+        fetched_at = self._clock()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO youtube_cache (channel_id, payload, fetched_at) '
+                'VALUES (?, ?, ?)',
+                (channel_id, json.dumps(payload), fetched_at))
+            conn.execute('DELETE FROM youtube_fetch_locks WHERE channel_id = ? AND owner = ?',
+                         (channel_id, owner))
+        self._remember(channel_id, payload, fetched_at)
+        return payload
+
+    def _acquire(self, conn, channel_id, owner):
+        """Take the channel's fetch lock unless a live one is held."""
+        now = self._clock()
+        with conn:
+            cursor = conn.execute(
+                '''
+                INSERT INTO youtube_fetch_locks (channel_id, owner, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (channel_id) DO UPDATE
+                SET owner = excluded.owner, expires_at = excluded.expires_at, error = NULL
+                WHERE youtube_fetch_locks.expires_at <= ?
+                ''',
+                (channel_id, owner, now + self.lock_ttl, now))
+        return cursor.rowcount == 1
+
+    def _fresh_row(self, conn, channel_id):
+        row = conn.execute(
+            'SELECT payload, fetched_at FROM youtube_cache WHERE channel_id = ?',
+            (channel_id,)).fetchone()
+        if row is None or self._clock() - row[1] >= self.fresh_ttl:
+            return None
+        payload = json.loads(row[0])
+        self._remember(channel_id, payload, row[1])
+        return payload
+
+    def _wait_for_other_worker(self, conn, channel_id, started):
+        """Wait while another worker holds the lock.
+
+        Returns what it stored, raises YouTubeFetchError if it failed, or
+        returns None once the lock is free to take.
+        """
+        while True:
+            row = conn.execute(
+                'SELECT expires_at, error FROM youtube_fetch_locks WHERE channel_id = ?',
+                (channel_id,)).fetchone()
+            if row is None:
+                cached = conn.execute(
+                    'SELECT payload, fetched_at FROM youtube_cache WHERE channel_id = ?',
+                    (channel_id,)).fetchone()
+                if cached is None or cached[1] < started:
+                    return None
+                payload = json.loads(cached[0])
+                self._remember(channel_id, payload, cached[1])
+                return payload
+            expires_at, error = row
+            if error is not None:
+                raise YouTubeFetchError(error)
+            if expires_at <= self._clock():
+                return None
+            time.sleep(self.poll_interval)
+
+    def wait_for_refreshes(self, timeout=None):
+        """Join the background refreshes currently running."""
+        with self._lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def clear(self):
+        """Empty the in-process tier; the table is left alone."""
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, channel_id):
+        with self._lock:
+            entry = self._entries.get(channel_id)
+            if entry is not None:
+                self._entries.move_to_end(channel_id)
+                if self._clock() - entry[1] < self.fresh_ttl:
+                    return entry
+        # Missing or stale here; another worker may have refreshed it
+        row = get_connection(self.path).execute(
+            'SELECT payload, fetched_at FROM youtube_cache WHERE channel_id = ?',
+            (channel_id,)).fetchone()
+        if row is None or (entry is not None and row[1] <= entry[1]):
+            return entry
+        payload = json.loads(row[0])
+        self._remember(channel_id, payload, row[1])
+        return payload, row[1]
+
+    def _remember(self, channel_id, payload, fetched_at):
+        with self._lock:
+            current = self._entries.get(channel_id)
+            # A slow refresh must not overwrite a newer entry
+            if current is None or current[1] <= fetched_at:
+                self._entries[channel_id] = (payload, fetched_at)
+            self._entries.move_to_end(channel_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh_in_background(self, channel_id):
+        with self._lock:
+            if channel_id in self._refreshing:
+                return
+            thread = threading.Thread(target=self._background_refresh,
+                                      args=(channel_id,), daemon=True,
+                                      name=f'youtube-refresh-{channel_id}')
+            self._refreshing[channel_id] = thread
+        thread.start()
+
+    def _background_refresh(self, channel_id):
+        # Short-lived thread: use a connection of its own rather than
+        # leaving one behind in the pool.
+        conn = None
+        try:
+            conn = connect(self.path)
+            self.refresh(channel_id, conn, background=True)
+            self._count('refreshes')
+        except Exception:
+            self._count('refresh_errors')
+            logger.exception('Refreshing YouTube videos for %s failed', channel_id)
+        finally:
+            if conn is not None:
+                conn.close()
+            with self._lock:
+                self._refreshing.pop(channel_id, None)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+quota_budget = QuotaBudget()
+youtube_cache = YouTubeCache(budget=quota_budget)
+
+
+class RefreshScheduler(threading.Thread):
+    """Daemon thread refreshing known channels before anyone asks.
+
+    Every ``interval`` seconds it adds this worker's request counts to the
+    channels' decaying scores in youtube_channels, then refreshes the
+    channels that are due, most popular first. The budget left for today
+    (minus the reserve) is split between channels by score. A channel's
+    refresh interval is the time until the quota resets divided by its
+    share of the remaining calls, and never shorter than the cache's fresh
+    TTL, so the spending adapts to what requests have already used.
+    """
+
+    def __init__(self, cache=youtube_cache, budget=quota_budget,
+                 interval=YOUTUBE_SCHEDULER_INTERVAL,
+                 half_life=YOUTUBE_POPULARITY_HALF_LIFE, clock=time.time):
+        super().__init__(name='youtube-scheduler', daemon=True)
+        self.cache = cache
+        self.budget = budget
+        self.interval = interval
+        self.half_life = half_life
+        self.stats = {'refreshed': 0, 'errors': 0, 'skipped_for_quota': 0,
+                      'last_run_at': None}
+        self._clock = clock
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = connect(self.cache.path)
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self.run_once(conn)
+                except Exception:
+                    logger.exception('YouTube refresh scheduling failed')
+                self._stop_event.wait(self.interval)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run_once(self, conn, now=None):
+        """Record request counts and refresh due channels; returns the ids
+        refreshed."""
+        now = self._clock() if now is None else now
+        self.record_requests(conn, now)
+        refreshed = []
+        for channel_id, _, _ in self.due_channels(conn, now):
+            if not self.budget.can_spend(conn, self.cache.cost, background=True, now=now):
+                self.stats['skipped_for_quota'] += 1
+                break
+            try:
+                self.cache.refresh(channel_id, conn, background=True)
+            except QuotaExhausted:
+                self.stats['skipped_for_quota'] += 1
+                break
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Scheduled refresh of %s failed', channel_id)
+                continue
+            self.stats['refreshed'] += 1
+            refreshed.append(channel_id)
+        self.stats['last_run_at'] = now
+        return refreshed
+
+    def record_requests(self, conn, now):
+        counts = self.cache.take_request_counts()
+        if not counts:
+            return
+        # One statement per channel, so counts recorded concurrently by
+        # other workers are decayed and added to rather than overwritten.
+        conn.create_function('youtube_decay', 3, _decay, deterministic=True)
+        with conn:
+            conn.executemany(
+                '''
+                INSERT INTO youtube_channels (channel_id, score, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (channel_id) DO UPDATE
+                SET score = youtube_decay(score, excluded.updated_at - updated_at, ?)
+                            + excluded.score,
+                    updated_at = MAX(updated_at, excluded.updated_at)
+                ''',
+                [(channel_id, count, now, self.half_life)
+                 for channel_id, count in counts.items()])
+
+    def plan(self, conn, now):
+        """Return ``(channel_id, score, interval)`` per known channel, most
+        popular first, with ``interval`` in seconds (inf when the budget
+        leaves nothing for it)."""
+        rows = conn.execute(
+            'SELECT channel_id, score, updated_at FROM youtube_channels').fetchall()
+        scores = [(row[0], self._decayed(row[1], row[2], now)) for row in rows]
+        total = sum(score for _, score in scores)
+        calls = self.budget.remaining(conn, background=True, now=now) // self.cache.cost
+        seconds_left = self.budget.seconds_until_reset(now)
+        plan = []
+        for channel_id, score in sorted(scores, key=lambda item: item[1], reverse=True):
+            share = calls * score / total if total else 0
+            interval = seconds_left / share if share else float('inf')
+            plan.append((channel_id, score, max(interval, self.cache.fresh_ttl)))
+        return plan
+
+    def due_channels(self, conn, now):
+        fetched = dict(conn.execute(
+            'SELECT channel_id, fetched_at FROM youtube_cache').fetchall())
+        return [(channel_id, score, interval)
+                for channel_id, score, interval in self.plan(conn, now)
+                if interval != float('inf')
+                and now - fetched.get(channel_id, float('-inf')) >= interval]
+
+    def _decayed(self, score, updated_at, now):
+        return _decay(score, now - updated_at, self.half_life)
+
+
+def _decay(score, age, half_life):
+    return score * 0.5 ** (max(age, 0) / half_life)